@@ -1,16 +1,27 @@
-from datetime import date
+import argparse
+from array import array
+from collections import Counter, deque, namedtuple
+from collections.abc import Sequence
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import date, datetime
+import errno
+import hashlib
 import json
 import os
-from pathlib import Path
+from pathlib import Path, PureWindowsPath
 import platform
 import re
 import shutil
 import sqlite3
+import struct
+import sys
 import tempfile
 from textwrap import dedent
 import time
 import traceback
 import uuid
+import zipfile
+import zlib
 
 from tqdm import tqdm
 
@@ -116,6 +127,25 @@ def locate_database(ck3_directory):
         return release_db
 
 
+def locate_game_files(database=True):
+    # The game's directory and, with database, the launcher database,
+    # for a command. Returns (ck3_directory, db_path),
+    # or None after printing the problem.
+    ck3_directory = locate_ck3_directory()
+    if ck3_directory is None:
+        print(
+            "ERROR: Game directory not found. Ensure the program is in the correct location."
+        )
+        return None
+    if not database:
+        return ck3_directory, None
+    db_path = locate_database(ck3_directory)
+    if db_path is None:
+        print("ERROR: Launcher database not found.")
+        return None
+    return ck3_directory, db_path
+
+
 def open_db_connection(db_path):
     # Connect to the launcher's SQLite database
     db_connection = sqlite3.connect(db_path)
@@ -124,14 +154,22 @@ def open_db_connection(db_path):
     return db_connection
 
 
-def select_playset(db_path):
-    db_connection = open_db_connection(db_path)
-
+def read_playsets(db_connection):
     # List playsets in the order the launcher uses.
     # Playset names aren't required to be unique,
     # so their internal IDs are needed.
     sql = "SELECT id, name FROM playsets ORDER BY rowid;"
-    playsets = db_connection.execute(sql).fetchall()
+    return db_connection.execute(sql).fetchall()
+
+
+def select_playset(db_path, scan_cache=None):
+    # With scan_cache, each playset is listed with its size and
+    # how long preserving it would take, as far as known from earlier runs
+    db_connection = open_db_connection(db_path)
+    playsets = read_playsets(db_connection)
+    estimates = {}
+    if scan_cache is not None:
+        estimates = estimate_playset_sizes(db_connection, scan_cache)
     db_connection.close()
 
     if len(playsets) == 0:
@@ -139,14 +177,35 @@ def select_playset(db_path):
         return None
 
     for i, playset in enumerate(playsets):
-        print(f"{i + 1}. {playset['name']}")
+        if (estimate := estimates.get(playset["id"])) is None:
+            print(f"{i + 1}. {playset['name']}")
+        else:
+            print(f"{i + 1}. {playset['name']} ({format_playset_estimate(estimate)})")
     print()
     choice = int(input("Select the playset by typing the corresponding number: ")) - 1
 
     return playsets[choice]
 
 
-def get_game_version(mods):
+def find_playset(db_path, playset_spec):
+    # Find a playset by name, internal ID, or number in the launcher's list
+    db_connection = open_db_connection(db_path)
+    playsets = read_playsets(db_connection)
+    db_connection.close()
+    return match_playset(playsets, playset_spec)
+
+
+def match_playset(playsets, playset_spec):
+    for playset in playsets:
+        if playset["name"] == playset_spec:
+            return playset
+    for i, playset in enumerate(playsets):
+        if playset["id"] == playset_spec or str(i + 1) == playset_spec:
+            return playset
+    return None
+
+
+def default_game_version(mods):
     def sort_key(version):
         # CK3 version matching rules:
         # * matches 0 or more characters (including .)
@@ -169,7 +228,20 @@ def get_game_version(mods):
     # Find the highest version required by any mod.
     # Provide an arbitrary default if somehow no mods have a suitable requiredVersion
     mod_versions = (mod["requiredVersion"] for mod in mods)
-    version = max(mod_versions, key=sort_key, default="1.12.*")
+    return max(mod_versions, key=sort_key, default="1.12.*")
+
+
+def check_game_version(version):
+    # The problem with a game version given by the user, or None
+    if "\\" in version:
+        return "Game version cannot contain \\"
+    if "\t" in version:
+        return "Game version cannot contain tab character"
+    return None
+
+
+def get_game_version(mods):
+    version = default_game_version(mods)
 
     # Prompt user
     while True:
@@ -178,10 +250,8 @@ def get_game_version(mods):
         ).strip()
         if not version_input:
             break
-        elif "\\" in version_input:
-            print("ERROR: Game version cannot contain \\")
-        elif "\t" in version_input:
-            print("ERROR: Game version cannot contain tab character")
+        elif problem := check_game_version(version_input):
+            print(f"ERROR: {problem}")
         else:
             version = version_input
             break
@@ -189,29 +259,69 @@ def get_game_version(mods):
     return version
 
 
+PLAYSET_MODS_SQL = (
+    "SELECT m.gameRegistryId, m.displayName, m.version, m.tags,"
+    " m.requiredVersion, m.dirPath, m.archivePath, m.status, pm.enabled"
+    " FROM mods AS m"
+    " JOIN playsets_mods AS pm ON m.id = pm.modId"
+    " WHERE pm.playsetId = ?"
+    " ORDER BY pm.position;"
+)
+
+
 def get_playset_mods(db_path, playset_id):
+    start = time.perf_counter()
     db_connection = open_db_connection(db_path)
-
-    sql = (
-        "SELECT m.gameRegistryId, m.displayName, m.version, m.tags,"
-        " m.requiredVersion, m.dirPath, m.archivePath, m.status, pm.enabled"
-        " FROM mods AS m"
-        " JOIN playsets_mods AS pm ON m.id = pm.modId"
-        " WHERE pm.playsetId = ?"
-        " ORDER BY pm.position;"
-    )
-    mods = db_connection.execute(sql, (playset_id,)).fetchall()
+    mods = db_connection.execute(PLAYSET_MODS_SQL, (playset_id,)).fetchall()
     db_connection.close()
+    log_timing("db_read", start, playsets=1, mods=len(mods))
 
     return mods
 
 
-def get_new_mod_name(playset_name, mod_directory):
-    # Default name appends current local date to original playset name.
-    # E.g. "My Playset (2024-05-06)"
+def find_playsets_mods(db_path, playset_specs):
+    # Find several playsets and their mods in one read of the database.
+    # Returns (playset, mods) for each spec, or None where none matches.
+    start = time.perf_counter()
+    db_connection = open_db_connection(db_path)
+    playsets = read_playsets(db_connection)
+    found = []
+    for playset_spec in playset_specs:
+        playset = match_playset(playsets, playset_spec)
+        if playset is None:
+            found.append(None)
+        else:
+            mods = db_connection.execute(PLAYSET_MODS_SQL, (playset["id"],)).fetchall()
+            found.append((playset, mods))
+    db_connection.close()
+    log_timing("db_read", start, playsets=len(playset_specs))
+    return found
+
+
+# Default name appends current local date to original playset name.
+# E.g. "My Playset (2024-05-06)"
+DEFAULT_MOD_NAME_TEMPLATE = "{playset} ({date})"
+
+
+def get_default_mod_name(
+    playset_name, template=DEFAULT_MOD_NAME_TEMPLATE, game_version=""
+):
+    # The template may use {playset}, {date} and {game_version}
     # Remove tabs and backslashes
     cleaned_name = re.sub(r"\t\\", "", playset_name)
-    default_mod_name = f"{cleaned_name} ({date.today()})"
+    return template.format(
+        playset=cleaned_name, date=date.today(), game_version=game_version
+    )
+
+
+def get_mod_folder(mod_name, mod_directory):
+    # Remove/replace characters disallowed in filename
+    folder_name = re.sub(r'[*"/:<>?|]', "", mod_name).rstrip(".")
+    return mod_directory / folder_name
+
+
+def get_new_mod_name(playset_name, mod_directory):
+    default_mod_name = get_default_mod_name(playset_name)
 
     while True:
         new_mod_name = input(
@@ -225,364 +335,3895 @@ def get_new_mod_name(playset_name, mod_directory):
             print("ERROR: Name must be at least 3 characters long")
         else:
             new_mod_name = new_mod_name or default_mod_name
-            # Remove/replace characters disallowed in filename
-            folder_name = re.sub(r'[*"/:<>?|]', "", new_mod_name).rstrip(".")
-            new_mod_folder = mod_directory / folder_name
+            new_mod_folder = get_mod_folder(new_mod_name, mod_directory)
             dotmod = new_mod_folder.with_name(f"{new_mod_folder.name}.mod")
-            if new_mod_folder.exists():
+            if (new_mod_folder / JOURNAL_FILE).exists():
+                # A preserve into this folder was interrupted
+                resume_input = input(
+                    f'Preserving "{new_mod_folder.name}" was interrupted.'
+                    "\nResume it, copying only the files that are still missing? - y/[n]: "
+                )
+                if resume_input.lower() == "y":
+                    return new_mod_name, new_mod_folder, True
+                print(f'ERROR: "{new_mod_folder.name}" already exists.')
+            elif is_preserved_playset(new_mod_folder):
+                # A playset preserved earlier can be refreshed in place
+                update_input = input(
+                    f'"{new_mod_folder.name}" is an existing preserved playset.'
+                    "\nUpdate it to match the selected playset? - y/[n]: "
+                )
+                if update_input.lower() == "y":
+                    return new_mod_name, new_mod_folder, True
+            elif new_mod_folder.exists():
                 print(f'ERROR: "{new_mod_folder.name}" already exists.')
             elif dotmod.exists():
                 print(f'ERROR: "{dotmod.name}" already exists.')
+            elif (archive := get_mod_archive(new_mod_folder)).exists():
+                print(f'ERROR: "{archive.name}" already exists.')
             else:
                 break
 
-    return new_mod_name, new_mod_folder
+    return new_mod_name, new_mod_folder, False
 
 
-def copy_mod_folders(mods, new_mod_folder):
-    def copy_mod_folders_with_retry(new_mod_folder, pbar):
-        def handle_dir(src, names):
-            # Called for every directory to be copied
-            pbar.update()
-            return [".git"] if ".git" in names else []  # Ignore .git
+# Open file that the time spent in each phase of the work is written to,
+# as JSON lines, if enabled with --timing-log
+timing_log = None
 
-        try:
-            # Iterate through mods as a queue in the correct order
-            while mods:
-                # Keep track of the position the progress bar should revert to
-                # in case of retrying after an error
-                pbar_checkpoint = pbar.n
-                # Copy the content of the mod folder into the destination.
-                # The "ignore" function is called for every directory to be copied,
-                # so it will handle both ignoring .git and updating the progress bar
-                pbar.write(f"Copying {mods[0]['displayName']}")
-                if archive_path := mods[0]["archivePath"]:
-                    mod_path = archive_dirs[archive_path].name
+
+def log_timing(phase, start, **details):
+    # start is the phase's time.perf_counter() when it began
+    if timing_log is not None:
+        entry = {
+            "phase": phase,
+            "seconds": round(time.perf_counter() - start, 6),
+            **details,
+        }
+        timing_log.write(json.dumps(entry) + "\n")
+
+
+def format_size(num_bytes):
+    for unit in ("B", "KB", "MB", "GB"):
+        if num_bytes < 1024 or unit == "GB":
+            break
+        num_bytes /= 1024
+    return f"{num_bytes:.0f} {unit}" if unit == "B" else f"{num_bytes:.1f} {unit}"
+
+
+def path_key(rel_path):
+    # Windows filesystems are case-insensitive, so paths differing only by case
+    # refer to the same file there
+    if os.name != "nt":
+        return rel_path
+    key = rel_path.lower()
+    # Most paths are lowercase already. Returning them as they are
+    # saves keeping a second copy of every path in dicts keyed by path.
+    return rel_path if key == rel_path else key
+
+
+def zip_member_mtime(info):
+    # Zip timestamps are in local time
+    return time.mktime(info.date_time + (0, 0, -1))
+
+
+def scan_mod_files(source, folder_times=None):
+    # List (relative path, size, mtime in ns) for every file in a mod folder
+    # or archive, with relative paths using / as the separator.
+    # If folder_times is a list, (relative path, mtime in ns) of every
+    # subfolder of a mod folder is added to it.
+    files = []
+    if isinstance(source, zipfile.ZipFile):
+        # Paradox Mods
+        # Only the archive's central directory is read here
+        for info in source.infolist():
+            parts = info.filename.split("/")
+            if info.is_dir() or ".git" in parts[:-1]:
+                continue
+            # Never write outside the merged mod folder. Names are checked
+            # as Windows paths, which rejects drive letters and backslashes
+            # as well as absolute paths and parent folders.
+            windows_path = PureWindowsPath(info.filename)
+            if windows_path.anchor or ".." in windows_path.parts:
+                continue
+            mtime_ns = int(zip_member_mtime(info)) * 1_000_000_000
+            files.append((info.filename, info.file_size, mtime_ns))
+        return files
+
+    # Steam Workshop and local mods
+    # Sizes and dates come with the directory entries, which on Windows
+    # saves reading every file's metadata separately.
+    # Folders are visited in the same order as os.walk.
+    folders = [("", source)]
+    while folders:
+        rel_root, folder = folders.pop()
+        subfolders = []
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                rel_path = rel_root + entry.name
+                if entry.is_dir():
+                    # .git and its contents are never copied.
+                    # Links to folders aren't followed, like os.walk.
+                    if entry.name != ".git" and not entry.is_symlink():
+                        subfolders.append((f"{rel_path}/", entry.path))
+                        # Taken before the folder is listed, so changes
+                        # made while it's listed are noticed next time
+                        if folder_times is not None:
+                            mtime_ns = entry.stat().st_mtime_ns
+                            folder_times.append((rel_path, mtime_ns))
                 else:
-                    mod_path = mods[0]["dirPath"]
-                shutil.copytree(
-                    mod_path,
-                    new_mod_folder,
-                    ignore=handle_dir,
-                    dirs_exist_ok=True,
-                )
-                if archive_path:
-                    # Clean up temporary directory of archive contents
-                    archive_dirs[archive_path].cleanup()
-                    del archive_dirs[archive_path]
-                # Remove mod from front of queue when successful
-                del mods[0]
-        except shutil.Error as e:
-            # Error's first argument is a list of (src, dst, error_msg) tuples
-            # (simultaneous errors are common)
-            _, first_error_dst, first_error_msg = e.args[0][0]
-            if (
-                len(first_error_dst) >= MAX_PATH
-                and "No such file or directory" in first_error_msg
-            ):
-                max_length = max(len(dst) for _, dst, _ in e.args[0])
-                shorter_by = max_length - MAX_PATH + 1
-                # Stop progress bar from overwriting the following exchange
-                pbar.close()
+                    stat = entry.stat()
+                    files.append((rel_path, stat.st_size, stat.st_mtime_ns))
+        folders.extend(reversed(subfolders))
+    return files
 
-                print()
-                print(
-                    'ERROR: I/O error matching Windows "file path too long" scenario.'
-                    f'\nCurrent mod folder name is "{new_mod_folder.name}",'
-                    f"\ncausing a path to reach {max_length} characters long."
-                )
-                while True:
-                    new_path_input = input(
-                        f"\nEnter a new folder name at least {shorter_by} characters shorter to recover and continue,"
-                        "\nor press Enter to print the error and exit: "
-                    ).strip()
-                    if not new_path_input:
-                        raise
-                    elif "\t" in new_path_input:
-                        print("ERROR: Folder name cannot contain tab character")
-                    elif new_path_input.endswith("."):
-                        print("ERROR: Folder name cannot end with .")
-                    elif matches := re.findall(r'[*"/:<>?\\|]', new_path_input):
-                        print(f"ERROR: Folder name cannot contain {''.join(matches)}")
-                    else:
-                        replacement_folder = new_mod_folder.parent / new_path_input
-                        if replacement_folder.exists():
-                            print(f'ERROR: "{new_path_input}" already exists.')
-                        else:
-                            break
-                # Preserve progress by renaming the existing folder
-                new_mod_folder = new_mod_folder.rename(replacement_folder)
-                print()
-                # Recreate progress bar
-                new_pbar = tqdm(
-                    total=pbar.total, initial=pbar_checkpoint, **tqdm_kwargs
-                )
-                # Try again to copy the remaining mods to the new destination
-                new_mod_folder = copy_mod_folders_with_retry(new_mod_folder, new_pbar)
-            else:
-                # Don't attempt to handle any other errors
-                raise
 
-        pbar.close()
-        # Propagate folder upwards, in case it changed
-        return new_mod_folder
+def folders_unchanged(source, folders):
+    # Whether the subfolders of a mod folder, given as scan_mod_files lists
+    # them, all still have the same modification time. A folder's time
+    # changes when files are added to it, removed or renamed.
+    for rel_path, mtime_ns in folders:
+        try:
+            if os.stat(os.path.join(source, rel_path)).st_mtime_ns != mtime_ns:
+                return False
+        except FileNotFoundError:
+            return False
+    return True
+
 
-    # Many Windows systems will error on paths >= 260 characters
-    MAX_PATH = 260
+def scan_mod_files_timed(source, cached_folders=None):
+    # Runs on the scanning thread pool.
+    # Returns the mod's files and subfolders and the seconds it took to list
+    # them. If cached_folders, the subfolders of a cached listing, are all
+    # unchanged, the listing is still valid and None is returned for both.
+    start = time.perf_counter()
+    if cached_folders is not None and folders_unchanged(source, cached_folders):
+        return None, None, time.perf_counter() - start
+    folders = []
+    files = scan_mod_files(source, folders)
+    return files, folders, time.perf_counter() - start
 
-    tqdm_kwargs = {"ascii": should_use_ascii(), "unit": "dirs"}
 
-    # This dict is used to generate file_to_mod_map.txt later
-    file_to_mod_map = {}
+# Mods scanned at once. Scanning mostly waits on the disk, and slow drives
+# handle several requests at once better than one after another.
+DEFAULT_SCAN_WORKERS = 8
 
-    # Make a copy of the mod list to modify, leaving the original unchanged
-    mods = list(mods)
 
-    # Create the directory
-    new_mod_folder.mkdir()
+# Listings of the mods' files from earlier runs, in the game's directory.
+# A listing is reused while the mod's version and the modification time
+# of its archive, or of its folder and every subfolder, stay the same.
+# That misses files changed in place, so the files used from a listing
+# are checked again when they're read.
+SCAN_CACHE_FILE = "CK3_PP_scan_cache.sqlite"
+# Listings and sizes written by older versions, which lack what's needed
+# to tell whether they're still valid, are dropped
+SCAN_CACHE_VERSION = 3
+# Beyond this many files, the listings used least recently are dropped
+SCAN_CACHE_MAX_FILES = 1_000_000
+SCAN_CACHE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS sources (
+        source_id INTEGER PRIMARY KEY,
+        gameRegistryId TEXT NOT NULL,
+        location TEXT NOT NULL,
+        version TEXT,
+        mtime_ns INTEGER NOT NULL,
+        file_count INTEGER NOT NULL,
+        last_used INTEGER NOT NULL,
+        UNIQUE (gameRegistryId, location)
+    );
+    CREATE TABLE IF NOT EXISTS files (
+        source_id INTEGER NOT NULL,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        hash TEXT,
+        UNIQUE (source_id, path)
+    );
+    CREATE TABLE IF NOT EXISTS folders (
+        source_id INTEGER NOT NULL,
+        path TEXT NOT NULL,
+        mtime_ns INTEGER NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS folders_source ON folders (source_id);
+    -- Kept when listings are evicted, so sizes are known for every mod scanned
+    CREATE TABLE IF NOT EXISTS mod_sizes (
+        gameRegistryId TEXT NOT NULL,
+        location TEXT NOT NULL,
+        version TEXT,
+        mtime_ns INTEGER NOT NULL,
+        file_count INTEGER NOT NULL,
+        total_bytes INTEGER NOT NULL,
+        PRIMARY KEY (gameRegistryId, location)
+    ) WITHOUT ROWID;
+    -- Size of the merged mod, by the mods it was planned from
+    CREATE TABLE IF NOT EXISTS playset_sizes (
+        mods_key TEXT PRIMARY KEY,
+        file_count INTEGER NOT NULL,
+        total_bytes INTEGER NOT NULL
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS copy_rates (
+        recorded_at REAL NOT NULL,
+        total_bytes INTEGER NOT NULL,
+        seconds REAL NOT NULL
+    );
+"""
 
-    archive_dirs = {}
-    # Count the total number of directories to be copied,
-    # and make that the basis for the progress bar
-    dir_count = 0
+
+def open_scan_cache(ck3_directory):
     try:
-        for mod in mods:
-            dir_count += 1  # Count the top-level directory too
-            if mod["archivePath"]:
-                # Paradox Mods
-                # The archive is extracted to a temporary directory before being
-                # copied like the others to simplify processing. This does waste
-                # a little time and space.
-                td = tempfile.TemporaryDirectory()
-                shutil.unpack_archive(mod["archivePath"], td.name)
-                archive_dirs[mod["archivePath"]] = td
-                mod_path = td.name
-            else:
-                # Steam Workshop and local mods
-                mod_path = mod["dirPath"]
-            for root, dirs, files in os.walk(mod_path):
-                rel_root = Path(root).relative_to(mod_path)
-                if rel_root != Path("."):  # top-level files are removed
-                    for file in files:
-                        file_to_mod_map[rel_root / file] = mod["displayName"]
-                # Don't count .git because it and its contents won't be copied
-                if ".git" in dirs:
-                    dirs.remove(".git")
-                dir_count += len(dirs)
-        # Create the progress bar
-        pbar = tqdm(total=dir_count, **tqdm_kwargs)
-        new_mod_folder = copy_mod_folders_with_retry(new_mod_folder, pbar)
-    finally:
-        if archive_dirs:
-            for td in archive_dirs.values():
-                td.cleanup()
+        scan_cache = sqlite3.connect(ck3_directory / SCAN_CACHE_FILE)
+        # Losing the last updates in a power cut is fine for a cache,
+        # and saves waiting for the disk after every mod
+        scan_cache.execute("PRAGMA journal_mode = WAL;")
+        scan_cache.execute("PRAGMA synchronous = NORMAL;")
+        (version,) = scan_cache.execute("PRAGMA user_version;").fetchone()
+        if version != SCAN_CACHE_VERSION:
+            scan_cache.executescript(
+                "DROP TABLE IF EXISTS sources; DROP TABLE IF EXISTS files;"
+                " DROP TABLE IF EXISTS folders; DROP TABLE IF EXISTS mod_sizes;"
+                f" PRAGMA user_version = {SCAN_CACHE_VERSION};"
+            )
+        scan_cache.executescript(SCAN_CACHE_SCHEMA)
+    except sqlite3.Error as e:
+        # The cache is only an optimization. One in memory still saves
+        # scanning mods used by several playsets more than once.
+        print(f"WARNING: Scan cache unavailable ({e}), all mods will be scanned.")
+        scan_cache = sqlite3.connect(":memory:")
+        scan_cache.executescript(SCAN_CACHE_SCHEMA)
+    return scan_cache
 
-    # Propagate correct mod folder upwards
-    return new_mod_folder, file_to_mod_map
 
+def find_cached_source(scan_cache, mod):
+    # Returns the ID of the mod's listing if its version and modification
+    # time still match, and the location and modification time identifying
+    # the current one. Its subfolders are for folders_unchanged to check.
+    location = mod["archivePath"] or mod["dirPath"]
+    mtime_ns = os.stat(location).st_mtime_ns
+    row = scan_cache.execute(
+        "SELECT source_id, version, mtime_ns FROM sources"
+        " WHERE gameRegistryId = ? AND location = ?;",
+        (mod["gameRegistryId"], location),
+    ).fetchone()
+    if row and (row[1], row[2]) == (mod["version"], mtime_ns):
+        return row[0], location, mtime_ns
+    return None, location, mtime_ns
 
-def clean_combined_folder(destination_path):
-    # A mess of thumbnails and READMEs wind up at the top of the mod folder.
-    # Remove all of them
-    for item in destination_path.iterdir():
-        if item.is_file():
-            item.unlink()
 
+def read_cached_listing(scan_cache, source_id):
+    # A listing found by find_cached_source, like scan_mod_files returns it
+    with scan_cache:
+        scan_cache.execute(
+            "UPDATE sources SET last_used = ? WHERE source_id = ?;",
+            (time.time_ns(), source_id),
+        )
+    sql = "SELECT path, size, mtime_ns FROM files WHERE source_id = ? ORDER BY rowid;"
+    return scan_cache.execute(sql, (source_id,)).fetchall()
 
-def create_dotmod_files(new_mod_folder, new_mod_name, game_version, mods):
-    # Gather mod tags from already-fetched data
-    # and replace_path lines from their .mod files
-    tags = set()
-    replace_paths = set()
-    for mod in mods:
-        # The tags column from the DB is JSON. There should never be
-        # quotation marks inside the tags, but escape them just in case.
-        tags.update(tag.replace('"', '\\"') for tag in json.loads(mod["tags"]))
-        src_mod_file_path = new_mod_folder.parent.parent / mod["gameRegistryId"]
-        with src_mod_file_path.open(encoding="utf-8") as file:
-            # Read .mod file with excessive tolerance
-            for line in file:
-                regex = r'\s*replace_path\s*=\s*"([^"]*(?:\\"[^"]*)*)"\s*(?:#.*)?'
-                if match := re.fullmatch(regex, line):
-                    replace_paths.add(match[1])
 
-    escaped_name = new_mod_name.replace('"', '\\"')
-    escaped_game_version = game_version.replace('"', '\\"')
-    lines = [
-        'version="1.0.0"',
-        "tags={",
-        *(f'\t"{tag}"' for tag in sorted(tags)),
-        "}",
-        f'name="{escaped_name}"',
-        f'supported_version="{escaped_game_version}"',
-        path_line := f'path="mod/{new_mod_folder.name}"',
-        *(f'replace_path="{path}"' for path in sorted(replace_paths)),
-    ]
+def read_cached_folders(scan_cache, source_id):
+    # The subfolders of a listing, like scan_mod_files lists them
+    sql = "SELECT path, mtime_ns FROM folders WHERE source_id = ?;"
+    return scan_cache.execute(sql, (source_id,)).fetchall()
 
-    # UTF-8 encoding, LF line endings
-    mod_file_path = new_mod_folder.with_name(f"{new_mod_folder.name}.mod")
-    with mod_file_path.open("w", encoding="utf-8", newline="") as file:
-        file.writelines(x + "\n" for x in lines)
 
-    # descriptor.mod normally lacks the path line
-    lines.remove(path_line)
+def record_cached_listing(scan_cache, mod, location, mtime_ns, files, folders):
+    # Remember a mod's files and subfolders, with the location and
+    # modification time find_cached_source gave before they were scanned.
+    # One transaction, so a listing is either stored whole or not at all
+    with scan_cache:
+        for (old_source_id,) in scan_cache.execute(
+            "SELECT source_id FROM sources WHERE gameRegistryId = ? AND location = ?;",
+            (mod["gameRegistryId"], location),
+        ).fetchall():
+            delete_cached_source(scan_cache, old_source_id)
+        source_id = scan_cache.execute(
+            "INSERT INTO sources (gameRegistryId, location, version, mtime_ns,"
+            " file_count, last_used) VALUES (?, ?, ?, ?, ?, ?);",
+            (
+                mod["gameRegistryId"],
+                location,
+                mod["version"],
+                mtime_ns,
+                len(files),
+                time.time_ns(),
+            ),
+        ).lastrowid
+        scan_cache.executemany(
+            "INSERT INTO files (source_id, path, size, mtime_ns) VALUES (?, ?, ?, ?);",
+            ((source_id, *file) for file in files),
+        )
+        scan_cache.executemany(
+            "INSERT INTO folders (source_id, path, mtime_ns) VALUES (?, ?, ?);",
+            ((source_id, *folder) for folder in folders),
+        )
+        scan_cache.execute(
+            "INSERT OR REPLACE INTO mod_sizes VALUES (?, ?, ?, ?, ?, ?);",
+            (
+                mod["gameRegistryId"],
+                location,
+                mod["version"],
+                mtime_ns,
+                len(files),
+                sum(size for _, size, _ in files),
+            ),
+        )
+        evict_scan_cache(scan_cache)
 
-    descriptor_path = new_mod_folder / "descriptor.mod"
-    with descriptor_path.open("w", encoding="utf-8", newline="") as file:
-        file.writelines(x + "\n" for x in lines)
 
+def delete_cached_source(scan_cache, source_id):
+    scan_cache.execute("DELETE FROM files WHERE source_id = ?;", (source_id,))
+    scan_cache.execute("DELETE FROM folders WHERE source_id = ?;", (source_id,))
+    scan_cache.execute("DELETE FROM sources WHERE source_id = ?;", (source_id,))
 
-def create_mod_version_files(new_mod_folder, playset, mods, file_to_mod_map):
-    with (new_mod_folder / "README.txt").open("w", encoding="utf-8") as f:
-        print(
-            "This mod was generated using Crusader Kings 3 Playset Preserver."
-            "\nGitHub repository: https://github.com/Ant0nidas/CK3-Playset-Preserver"
-            "\nCMH Discord: https://discord.gg/GuDjt9YQ",
-            file=f,
+
+def evict_scan_cache(scan_cache, max_files=SCAN_CACHE_MAX_FILES):
+    # Drop the listings used least recently until the cache is small enough
+    sql = "SELECT SUM(file_count) FROM sources;"
+    (total_files,) = scan_cache.execute(sql).fetchone()
+    sql = "SELECT source_id, file_count FROM sources ORDER BY last_used;"
+    for source_id, file_count in scan_cache.execute(sql).fetchall():
+        if total_files <= max_files:
+            break
+        delete_cached_source(scan_cache, source_id)
+        total_files -= file_count
+
+
+def get_cached_hashes(scan_cache, mod):
+    # Content hashes known for the current version of the mod's files,
+    # as (size, mtime in ns, hash) by path. A hash only holds while the file
+    # still has that size and modification time.
+    source_id, _, _ = find_cached_source(scan_cache, mod)
+    sql = (
+        "SELECT path, size, mtime_ns, hash FROM files"
+        " WHERE source_id = ? AND hash IS NOT NULL;"
+    )
+    return {
+        path: (size, mtime_ns, digest)
+        for path, size, mtime_ns, digest in scan_cache.execute(sql, (source_id,))
+    }
+
+
+def record_cached_hashes(scan_cache, mod, hashes):
+    # Remember content hashes of the mod's files, given by path
+    # like get_cached_hashes returns them
+    source_id, _, _ = find_cached_source(scan_cache, mod)
+    if source_id is None:
+        return
+    with scan_cache:
+        scan_cache.executemany(
+            "UPDATE files SET size = ?, mtime_ns = ?, hash = ?"
+            " WHERE source_id = ? AND path = ?;",
+            (
+                (size, mtime_ns, digest, source_id, path)
+                for path, (size, mtime_ns, digest) in hashes.items()
+            ),
         )
-        print(file=f)
-        print(f"Source playset: {playset['name']}", file=f)
-        print(f"Date: {date.today()}", file=f)
-        print("Contents:", file=f)
-        for mod in mods:
-            print(f"{mod['displayName']} ({mod['version']})", file=f)
 
-    with (new_mod_folder / "file_to_mod_map.txt").open("w", encoding="utf-8") as f:
-        for file, mod in sorted(file_to_mod_map.items()):
-            print(f"{file} <- [{mod}]", file=f)
 
+def playset_mods_key(mods):
+    # Identifies a list of mods in load order, and their versions
+    digest = hashlib.blake2b(digest_size=16)
+    for mod in mods:
+        location = mod["archivePath"] or mod["dirPath"]
+        line = f"{mod['gameRegistryId']}\t{location}\t{mod['version']}\n"
+        digest.update(line.encode())
+    return digest.hexdigest()
 
-def create_playset(db_path, mod_name, mod_folder_name):
-    mod_id = str(uuid.uuid4())  # New random ID
-    mod_file = f"mod/{mod_folder_name}.mod"
-    created = time.time_ns() // 1000000  # Unix time in milliseconds
-    playset_id = str(uuid.uuid4())  # New random ID
-    playset_name = mod_name
 
-    db_connection = open_db_connection(db_path)
-    db_connection.execute(
-        "INSERT INTO mods (id, gameRegistryId, displayName, status, source, createdDate) VALUES"
-        " (?, ?, ?, 'ready_to_play', 'local', ?);",
-        (mod_id, mod_file, mod_name, created),
-    )
-    db_connection.execute(
-        "INSERT INTO playsets (id, name, isActive, loadOrder, createdOn, syncState) VALUES"
-        " (?, ?, 0, 'custom', ?, 'NOT_ELIGIBLE');",
-        (playset_id, playset_name, created),
-    )
-    db_connection.execute(
-        "INSERT INTO playsets_mods (playsetId, modId, position) VALUES (?, ?, 0);",
-        (playset_id, mod_id),
+def record_playset_size(scan_cache, mods, merge_plan):
+    planned_bytes = sum(planned.size for planned in merge_plan.files)
+    with scan_cache:
+        scan_cache.execute(
+            "INSERT OR REPLACE INTO playset_sizes VALUES (?, ?, ?);",
+            (playset_mods_key(mods), len(merge_plan.files), planned_bytes),
+        )
+
+
+def record_copy_rate(scan_cache, num_bytes, seconds):
+    with scan_cache:
+        scan_cache.execute(
+            "INSERT INTO copy_rates VALUES (?, ?, ?);",
+            (time.time(), num_bytes, seconds),
+        )
+
+
+# Earlier preserves the copy time estimates are based on
+COPY_RATE_RUNS = 10
+
+
+def read_mod_sizes(scan_cache):
+    # (version, mtime in ns, file count, total bytes) of the mods
+    # as last scanned, by gameRegistryId and location
+    sql = (
+        "SELECT gameRegistryId, location, version, mtime_ns, file_count, total_bytes"
+        " FROM mod_sizes;"
     )
-    # Commit the changes in one transaction
-    db_connection.commit()
-    db_connection.close()
+    return {tuple(row[:2]): tuple(row[2:]) for row in scan_cache.execute(sql)}
 
 
-def main():
-    display_welcome_message()
+def estimate_playset_sizes(db_connection, scan_cache):
+    # Estimate the size of every playset in the launcher, mostly without
+    # touching the mods themselves: sizes come from earlier scans of the same
+    # versions of the mods, and the copy rate from earlier preserves.
+    # Mods updated since they were scanned count as stale until they're used.
+    # Returns a PlaysetEstimate by playset ID.
+    sql = (
+        "SELECT SUM(total_bytes), SUM(seconds) FROM"
+        " (SELECT total_bytes, seconds FROM copy_rates"
+        " ORDER BY recorded_at DESC LIMIT ?);"
+    )
+    rate_bytes, rate_seconds = scan_cache.execute(sql, (COPY_RATE_RUNS,)).fetchone()
+    bytes_per_second = rate_bytes / rate_seconds if rate_seconds else None
 
-    # Agreement prompt
-    print()
-    agreement = input(
-        "No support or troubleshooting is provided for preserved playsets."
-        "\nBy using this method, you agree to not seek advice for gameplay or mod-related issues,"
-        "\nbe it on the authors' Discord servers, Steam pages, or elsewhere."
-        "\nYou are not allowed to distribute the preserved playset. All content belong to their respective authors."
-        "\nHave you understood? - y/[n]: "
+    # All playsets' mods in one query, rather than one per playset
+    sql = (
+        "SELECT pm.playsetId, m.gameRegistryId, m.displayName, m.version,"
+        " m.dirPath, m.archivePath"
+        " FROM playsets_mods AS pm JOIN mods AS m ON m.id = pm.modId"
+        " WHERE pm.enabled AND m.status = 'ready_to_play'"
+        " AND (m.dirPath IS NOT NULL OR m.archivePath IS NOT NULL)"
+        " ORDER BY pm.playsetId, pm.position;"
     )
-    if agreement.lower() != "y":
-        print()
-        print("Exiting program. Please re-run the program if you agree to the terms.")
-        return
+    playset_mods = {}
+    for row in db_connection.execute(sql):
+        playset_mods.setdefault(row["playsetId"], []).append(row)
 
-    ck3_directory = locate_ck3_directory()
-    if ck3_directory is None:
-        print()
-        print(
-            "ERROR: Game directory not found. Ensure the program is in the correct location."
+    # Whether each mod's size is known for its current version (True), only
+    # for an earlier one (False) or not at all (None), by gameRegistryId and
+    # location
+    mod_sizes = read_mod_sizes(scan_cache)
+    current = {}
+    for mods in playset_mods.values():
+        for mod in mods:
+            key = (mod["gameRegistryId"], mod["archivePath"] or mod["dirPath"])
+            if key in current:
+                continue
+            try:
+                mtime_ns = os.stat(key[1]).st_mtime_ns
+            except OSError:
+                mtime_ns = None
+            mod_size = mod_sizes.get(key)
+            if mod_size is not None:
+                current[key] = mod_size[:2] == (mod["version"], mtime_ns)
+            else:
+                current[key] = None
+
+    estimates = {}
+    for playset_id, mods in playset_mods.items():
+        total_bytes = 0
+        unknown_mods = 0
+        stale_mods = 0
+        for mod in mods:
+            key = (mod["gameRegistryId"], mod["archivePath"] or mod["dirPath"])
+            if current[key]:
+                total_bytes += mod_sizes[key][3]
+            elif current[key] is None:
+                unknown_mods += 1
+            else:
+                stale_mods += 1
+        sql = "SELECT total_bytes FROM playset_sizes WHERE mods_key = ?;"
+        row = scan_cache.execute(sql, (playset_mods_key(mods),)).fetchone()
+        merged_bytes = row[0] if row else None
+        seconds = None
+        if bytes_per_second and not unknown_mods and not stale_mods:
+            seconds = (total_bytes if merged_bytes is None else merged_bytes) / (
+                bytes_per_second
+            )
+        estimates[playset_id] = PlaysetEstimate(
+            len(mods), unknown_mods, stale_mods, total_bytes, merged_bytes, seconds
         )
-        return
+    return estimates
 
-    mod_directory = ck3_directory / "mod"
 
-    db_path = locate_database(ck3_directory)
-    if db_path is None:
-        print("ERROR: Launcher database not found.")
-        return
+# What's known of a playset before scanning it: its number of mods, how many
+# of them were never scanned and how many were updated since they were scanned,
+# the size of the others, the size of the merged mod if the same mods were
+# planned before, and the estimated copy time
+PlaysetEstimate = namedtuple(
+    "PlaysetEstimate",
+    "mods unknown_mods stale_mods total_bytes merged_bytes seconds",
+)
 
-    # Select the playset based on the launcher database
-    print()
-    playset = select_playset(db_path)
-    if playset is None:
-        return
 
-    # Load the mods from the selected playset
-    mods = get_playset_mods(db_path, playset["id"])
+def format_playset_estimate(estimate):
+    parts = [f"{estimate.mods} mods"]
+    if estimate.unknown_mods + estimate.stale_mods < estimate.mods:
+        parts.append(format_size(estimate.total_bytes))
+        if estimate.unknown_mods:
+            parts[-1] += f" + {estimate.unknown_mods} mods not scanned yet"
+        if estimate.stale_mods:
+            parts[-1] += f" + {estimate.stale_mods} mods updated since scanned"
+    if estimate.merged_bytes is not None:
+        parts.append(f"{format_size(estimate.merged_bytes)} merged")
+    if estimate.seconds is not None:
+        parts.append(f"about {format_duration(estimate.seconds)}")
+    return ", ".join(parts)
 
-    # Mods that are missing on disk (red error sign in launcher)
-    # have a different status from ready_to_play.
-    if not_found_mods := [m for m in mods if m["status"] != "ready_to_play"]:
-        print()
-        print("ERROR: The launcher cannot find the following mods:")
-        for mod in not_found_mods:
-            mods.remove(mod)
-            print(f"- {mod['displayName']}")
-        print("Unsubscribing, resubscribing, and restarting the launcher might resolve this.")
-        continue_input = input("Ignore these mods and continue? - y/[n]: ")
-        if continue_input.lower() != "y":
-            print("Exiting program.")
-            return
 
-    # Skip mods disabled in playset and inform user
-    if disabled_mods := [m for m in mods if not m["enabled"]]:
-        print()
-        print(
-            "The following mods are disabled in the selected playset"
-            "\nand will NOT be included in the preserved playset:"
-        )
-        for mod in disabled_mods:
-            mods.remove(mod)
-            print(f"- {mod['displayName']}")
+def format_duration(seconds):
+    if seconds < 60:
+        return f"{max(1, round(seconds))} s"
+    if seconds < 3600:
+        return f"{round(seconds / 60)} min"
+    return f"{seconds / 3600:.1f} h"
 
-    # Prompt for the game version
-    print()
-    game_version = get_game_version(mods)
 
-    # Prompt user for mod/playset name
-    new_mod_name, new_mod_folder = get_new_mod_name(playset["name"], mod_directory)
+def list_mod_files(mods, sources, scan_cache=None, workers=DEFAULT_SCAN_WORKERS):
+    # scan_mod_files for every mod, in load order. Mods are scanned several
+    # at once, and listings from the scan cache are reused if given.
+    listings = [None] * len(mods)
+    scans = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for mod_index, (mod, source) in enumerate(zip(mods, sources)):
+            source_id = location = mtime_ns = cached_folders = None
+            if scan_cache is not None:
+                source_id, location, mtime_ns = find_cached_source(scan_cache, mod)
+                if source_id is not None:
+                    cached_folders = read_cached_folders(scan_cache, source_id)
+            future = executor.submit(scan_mod_files_timed, source, cached_folders)
+            scans[mod_index] = (source_id, location, mtime_ns, future)
 
-    # Copy mod folders based on the launcher database
-    # (Mod folder may change to recover from long path errors)
-    print()
-    print("Starting copy operation...")
-    new_mod_folder, file_to_mod_map = copy_mod_folders(mods, new_mod_folder)
+        # The cache's connection can only be used by this thread
+        for mod_index, (source_id, location, mtime_ns, future) in scans.items():
+            mod = mods[mod_index]
+            files, folders, seconds = future.result()
+            if files is None:
+                listings[mod_index] = read_cached_listing(scan_cache, source_id)
+                log_timing(
+                    "scan",
+                    time.perf_counter() - seconds,
+                    mod=mod["gameRegistryId"],
+                    files=len(listings[mod_index]),
+                    cached=True,
+                )
+                continue
+            listings[mod_index] = files
+            print(
+                f"Scanned {mod['displayName']}: {len(files)} files in {seconds:.1f} s"
+            )
+            log_timing(
+                "scan",
+                time.perf_counter() - seconds,
+                mod=mod["gameRegistryId"],
+                files=len(files),
+                cached=False,
+            )
+            if scan_cache is not None:
+                record_cached_listing(
+                    scan_cache, mod, location, mtime_ns, files, folders
+                )
+    return listings
 
-    # Clean up the combined folder
-    clean_combined_folder(new_mod_folder)
 
-    # Create the <name>.mod and descriptor.mod files
-    create_dotmod_files(new_mod_folder, new_mod_name, game_version, mods)
+def read_replace_paths(mod_file_path):
+    replace_paths = []
+    with mod_file_path.open(encoding="utf-8") as file:
+        # Read .mod file with excessive tolerance
+        for line in file:
+            regex = r'\s*replace_path\s*=\s*"([^"]*(?:\\"[^"]*)*)"\s*(?:#.*)?'
+            if match := re.fullmatch(regex, line):
+                replace_paths.append(match[1])
+    return replace_paths
 
-    create_mod_version_files(new_mod_folder, playset, mods, file_to_mod_map)
 
-    print()
-    print(f"Preserved playset mod {new_mod_name} created in {new_mod_folder}")
+def get_mod_descriptor(mod, ck3_directory):
+    # The launcher's .mod file of a mod, or for a staged version of it,
+    # the copy made when it was staged
+    if "descriptorPath" in mod.keys():
+        return Path(mod["descriptorPath"])
+    return ck3_directory / mod["gameRegistryId"]
 
-    # Prompt to create the playset in the launcher's DB
-    print()
-    create_playset_input = input(
-        "Create a new playset in launcher containing only this new mod? - [y]/n: "
-    )
-    if create_playset_input.lower() != "n":
-        create_playset(db_path, new_mod_name, new_mod_folder.name)
-        print(f"Playset {new_mod_name} created in launcher")
 
-    print()
-    print("If launcher is open, close and reopen it to see changes.")
+def read_mod_replace_paths(mods, ck3_directory):
+    return [read_replace_paths(get_mod_descriptor(mod, ck3_directory)) for mod in mods]
+
+
+def open_mod_sources(mods):
+    sources = []
+    try:
+        for mod in mods:
+            if mod["archivePath"]:
+                # Paradox Mods
+                # Archive members are read in place. Only the ones that end up
+                # in the merged mod are ever decompressed.
+                start = time.perf_counter()
+                sources.append(zipfile.ZipFile(mod["archivePath"]))
+                log_timing("archive_open", start, archive=mod["archivePath"])
+            else:
+                # Steam Workshop and local mods
+                sources.append(mod["dirPath"])
+    except BaseException:
+        close_mod_sources(sources)
+        raise
+    return sources
+
+
+def close_mod_sources(sources):
+    for source in sources:
+        if isinstance(source, zipfile.ZipFile):
+            source.close()
+
+
+# One file of the merged mod and the mod it comes from
+PlannedFile = namedtuple("PlannedFile", "mod_index rel_path size mtime_ns")
+
+
+class PlannedFiles(Sequence):
+    # A sequence of PlannedFile, kept compact for playsets with hundreds of
+    # thousands of files: each folder path is stored once, with only the
+    # file names kept per file, and the numbers are kept in typed arrays
+    # rather than as separate objects. Each PlannedFile is built when read.
+    __slots__ = (
+        "_folders",
+        "_folder_indexes",
+        "_folder_numbers",
+        "_names",
+        "_mod_indexes",
+        "_sizes",
+        "_mtimes",
+    )
+
+    def __init__(self, files=()):
+        self._folders = []
+        self._folder_indexes = {}
+        self._folder_numbers = array("I")
+        self._names = []
+        self._mod_indexes = array("H")
+        self._sizes = array("q")
+        self._mtimes = array("q")
+        for planned in files:
+            self.append(planned)
+
+    def append(self, planned):
+        folder, _, name = planned.rel_path.rpartition("/")
+        folder_number = self._folder_indexes.get(folder)
+        if folder_number is None:
+            folder_number = self._folder_indexes[folder] = len(self._folders)
+            self._folders.append(folder)
+        self._folder_numbers.append(folder_number)
+        self._names.append(name)
+        self._mod_indexes.append(planned.mod_index)
+        self._sizes.append(planned.size)
+        self._mtimes.append(planned.mtime_ns)
+
+    def set_stat(self, index, size, mtime_ns):
+        # For files found changed since they were listed
+        self._sizes[index] = size
+        self._mtimes[index] = mtime_ns
+
+    def _build(self, folder_number, name, mod_index, size, mtime_ns):
+        folder = self._folders[folder_number]
+        rel_path = f"{folder}/{name}" if folder else name
+        return PlannedFile(mod_index, rel_path, size, mtime_ns)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self._build(
+            self._folder_numbers[index],
+            self._names[index],
+            self._mod_indexes[index],
+            self._sizes[index],
+            self._mtimes[index],
+        )
+
+    def __iter__(self):
+        for fields in zip(
+            self._folder_numbers,
+            self._names,
+            self._mod_indexes,
+            self._sizes,
+            self._mtimes,
+        ):
+            yield self._build(*fields)
+
+
+# The files of a merged mod, the versions of files that were overridden
+# by path key, and the total size of all files in the source mods
+MergePlan = namedtuple("MergePlan", "files overridden scanned_bytes")
+
+
+def plan_merge(listings, replace_paths):
+    # Decide which mod provides each file of the merged mod,
+    # given the files of each mod as listed by scan_mod_files.
+    # Later mods in the load order override earlier ones, so only the last
+    # mod providing a path needs to be copied for it.
+    # The versions that lose out are kept in overridden, by path.
+    # The mods are gone through from the last one back, so the first version
+    # of a path seen is the winner, and only the positions of the winners
+    # in each listing are kept until the plan is built. Each listing is
+    # dropped from listings once its files are planned.
+    seen = set()
+    # Folders hidden by a replace_path from the mods gone through next
+    hidden = set()
+    overridden = {}
+    winner_positions = []
+    scanned_bytes = 0
+    for mod_index in reversed(range(len(listings))):
+        listing = listings[mod_index]
+        positions = array("I")
+        # Within a mod too, a later duplicate of a path wins
+        for position in reversed(range(len(listing))):
+            rel_path, size, mtime_ns = listing[position]
+            scanned_bytes += size
+            if "/" not in rel_path:
+                # A mess of thumbnails and READMEs sits at the top of each
+                # mod folder. None of them belong in the merged mod.
+                continue
+            key = path_key(rel_path)
+            if key in seen:
+                overridden.setdefault(key, []).append(
+                    PlannedFile(mod_index, rel_path, size, mtime_ns)
+                )
+            elif key.rpartition("/")[0] not in hidden:
+                seen.add(key)
+                positions.append(position)
+            # Otherwise hidden and never provided again, so the path
+            # isn't part of the merged mod at all
+        winner_positions.append(positions)
+        # A replace_path hides the files directly inside that directory
+        # (not its subdirectories) from everything loaded before the mod
+        # declaring it. The merged mod keeps the replace_path lines,
+        # so files from earlier mods there would be ignored by the game.
+        hidden.update(path_key(p.strip("/")) for p in replace_paths[mod_index])
+    del seen, hidden
+    winner_positions.reverse()
+    # Overridden versions in load order
+    for losers in overridden.values():
+        losers.reverse()
+
+    # Copy mod by mod in load order
+    files = PlannedFiles()
+    for mod_index, positions in enumerate(winner_positions):
+        listing = listings[mod_index]
+        for position in reversed(positions):
+            files.append(PlannedFile(mod_index, *listing[position]))
+        listings[mod_index] = None
+        winner_positions[mod_index] = None
+    return MergePlan(files, overridden, scanned_bytes)
+
+
+# Ways of putting a file from a mod folder into the merged mod:
+# - reflink: share the data copy-on-write where the filesystem supports it,
+#   otherwise copy
+# - hardlink: make the merged file the same file as the source, where both are
+#   on the same volume. Changes to either (e.g. a Steam update rewriting a mod
+#   file in place) then show up in both.
+# - copy: always write a separate copy
+LINK_STRATEGIES = ("reflink", "hardlink", "copy")
+
+# Linux ioctl cloning a file's data copy-on-write (Btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+# Errors that mean a kernel-side copy method doesn't apply to the files at hand,
+# as opposed to the copy itself failing
+UNSUPPORTED_COPY_ERRNOS = {
+    errno.EBADF,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.ENOTTY,
+    errno.EOPNOTSUPP,
+    errno.EXDEV,
+}
+
+
+def clone_file_macos(src, dst):
+    # APFS clones, copy-on-write
+    import ctypes
+
+    libc = ctypes.CDLL(None, use_errno=True)
+    return libc.clonefile(os.fsencode(src), os.fsencode(dst), 0) == 0
+
+
+def copy_file_linux(fsrc, fdst, reflink):
+    # Try kernel-side methods first, so the data doesn't pass through Python
+    infd, outfd = fsrc.fileno(), fdst.fileno()
+    if reflink:
+        import fcntl
+
+        try:
+            fcntl.ioctl(outfd, FICLONE, infd)
+            return "reflink"
+        except OSError as e:
+            if e.errno not in UNSUPPORTED_COPY_ERRNOS:
+                raise
+
+    offset = 0
+    if hasattr(os, "copy_file_range"):
+        try:
+            while copied := os.copy_file_range(infd, outfd, 2**30):
+                offset += copied
+            return "copy_file_range"
+        except OSError as e:
+            # Only fall back if nothing was written yet
+            if offset or e.errno not in UNSUPPORTED_COPY_ERRNOS:
+                raise
+    try:
+        while sent := os.sendfile(outfd, infd, offset, 2**30):
+            offset += sent
+        return "sendfile"
+    except OSError as e:
+        if offset or e.errno not in UNSUPPORTED_COPY_ERRNOS:
+            raise
+
+    shutil.copyfileobj(fsrc, fdst)
+    return "copy"
+
+
+def copy_file(src, dst, link_strategy):
+    # Returns the name of the method that was used
+    if link_strategy == "hardlink":
+        try:
+            os.link(src, dst)
+            return "hardlink"
+        except OSError:
+            # e.g. the source is on another volume
+            pass
+    if sys.platform == "darwin":
+        if link_strategy != "copy" and clone_file_macos(src, dst):
+            return "reflink"
+        # Python already copies with the kernel's fcopyfile here
+        shutil.copy2(src, dst)
+        return "copy"
+    if sys.platform.startswith("linux"):
+        with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+            method = copy_file_linux(fsrc, fdst, link_strategy != "copy")
+        shutil.copystat(src, dst)
+        return method
+    shutil.copy2(src, dst)
+    return "copy"
+
+
+def copy_mod_file(source, rel_path, dst, link_strategy):
+    # Returns the name of the method that was used
+    if isinstance(source, zipfile.ZipFile):
+        extract_mod_file(source, rel_path, dst)
+        return "extract"
+    return copy_file(os.path.join(source, rel_path), dst, link_strategy)
+
+
+def extract_mod_file(archive, rel_path, dst):
+    # Decompress an archive member straight to its destination.
+    # The data passes through here anyway, so it's hashed on the way.
+    # Returns the content hash.
+    digest = hashlib.blake2b(digest_size=16)
+    with archive.open(rel_path) as fsrc, dst.open("wb") as fdst:
+        while chunk := fsrc.read(1024 * 1024):
+            digest.update(chunk)
+            fdst.write(chunk)
+    # Keep the member's timestamp, like copying a file would
+    mtime = zip_member_mtime(archive.getinfo(rel_path))
+    os.utime(dst, (mtime, mtime))
+    return digest.hexdigest()
+
+
+def hash_file(file):
+    # file is a path or an open binary file object
+    if not hasattr(file, "read"):
+        with open(file, "rb") as f:
+            return hash_file(f)
+    digest = hashlib.blake2b(digest_size=16)
+    while chunk := file.read(1024 * 1024):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_mod_file(source, rel_path):
+    if isinstance(source, zipfile.ZipFile):
+        with source.open(rel_path) as f:
+            return hash_file(f)
+    return hash_file(os.path.join(source, rel_path))
+
+
+def stat_mod_file(source, rel_path):
+    # (size, mtime in ns) of a mod file as it is now, as scan_mod_files
+    # lists them. Raises FileNotFoundError if it's gone.
+    if isinstance(source, zipfile.ZipFile):
+        try:
+            info = source.getinfo(rel_path)
+        except KeyError:
+            raise FileNotFoundError(rel_path) from None
+        return info.file_size, int(zip_member_mtime(info)) * 1_000_000_000
+    stat = os.stat(os.path.join(source, rel_path))
+    return stat.st_size, stat.st_mtime_ns
+
+
+def destination_matches(source, planned, dst, compare):
+    # Whether dst already holds the planned file, and dst's content hash
+    # if it was computed.
+    # Files of different sizes never match. Otherwise, compare is "mtime" to
+    # trust a matching modification time, and compare contents only when it
+    # differs, or "hash" to always compare contents.
+    try:
+        dst_stat = dst.stat()
+    except FileNotFoundError:
+        return False, None
+    if dst_stat.st_size != planned.size:
+        return False, None
+    # Compare whole seconds, as not every filesystem keeps finer timestamps
+    if compare == "mtime" and (
+        dst_stat.st_mtime_ns // 1_000_000_000 == planned.mtime_ns // 1_000_000_000
+    ):
+        return True, None
+    # e.g. the same file shipped by another mod, or a mod update
+    # that rewrote the file without changing it
+    dst_hash = hash_file(dst)
+    return dst_hash == hash_mod_file(source, planned.rel_path), dst_hash
+
+
+# Suffix of files being written. They are renamed into place once complete,
+# so an interrupted copy never leaves a partial file under the final name.
+PARTIAL_SUFFIX = ".ck3pp-partial"
+
+# Folder in the mod directory holding one copy of each file content
+# of the merged mods preserved with it, named by content hash.
+# Their files are hard links to it, so identical files take space only once.
+STORE_FOLDER = "CK3_PP_store"
+
+
+def store_object_path(store_folder, digest):
+    # Spread the objects over subfolders, as some filesystems slow down
+    # with very many files in one folder
+    return store_folder / digest[:2] / digest[2:]
+
+
+def add_store_object(source, rel_path, store_object):
+    # Copy a mod file into the store, unless the content is already there.
+    # Returns whether it was added.
+    if store_object.exists():
+        return False
+    store_object.parent.mkdir(parents=True, exist_ok=True)
+    # Another thread may be adding the same content at the same time,
+    # so each writes its own partial file. Either copy may win the rename.
+    partial = store_object.with_name(
+        f"{store_object.name}.{uuid.uuid4().hex}{PARTIAL_SUFFIX}"
+    )
+    # Never hard-link the mod's file, which Steam or the mod's author
+    # could change in place
+    copy_mod_file(source, rel_path, partial, "reflink")
+    os.replace(partial, store_object)
+    return True
+
+
+def copy_planned_file(
+    source,
+    planned,
+    new_mod_folder,
+    link_strategy,
+    compare,
+    recorded_hash,
+    store_folder=None,
+):
+    # Runs on the copy thread pool.
+    # compare is None if the destination can't exist yet,
+    # otherwise it's passed to destination_matches.
+    # With store_folder, the file is linked from the store instead of copied.
+    # Returns the copy method used, or None if the file didn't need copying,
+    # the file's content hash, or None for linked files, and planned with the
+    # size and date the source has now.
+    # Copies hash the source right after writing, while it's still cached.
+    # Linked files share the source's data, so they're left for verify and
+    # diff to hash from the mod while it's unchanged.
+    # The plan may come from a cached listing, which misses files changed
+    # in place, so the source is checked as it is now.
+    size, mtime_ns = stat_mod_file(source, planned.rel_path)
+    planned = planned._replace(size=size, mtime_ns=mtime_ns)
+    dst = new_mod_folder / planned.rel_path
+    if compare:
+        # Updating an existing merged mod
+        matches, dst_hash = destination_matches(source, planned, dst, compare)
+        if matches:
+            return None, dst_hash or recorded_hash, planned
+    # Directories shared by several files may be created concurrently,
+    # which mkdir with exist_ok tolerates.
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    partial = dst.with_name(dst.name + PARTIAL_SUFFIX)
+    # A leftover from an interrupted copy might be a hard link to a file in
+    # a mod folder, so it's removed rather than written through.
+    # Likewise, replacing dst by renaming never writes through the old file.
+    try:
+        partial.unlink()
+    except FileNotFoundError:
+        pass
+    if store_folder is None:
+        digest = None
+        if isinstance(source, zipfile.ZipFile):
+            method = "extract"
+            digest = extract_mod_file(source, planned.rel_path, partial)
+        else:
+            method = copy_mod_file(source, planned.rel_path, partial, link_strategy)
+            if method not in ("hardlink", "reflink"):
+                digest = hash_mod_file(source, planned.rel_path)
+        os.replace(partial, dst)
+        return method, digest, planned
+
+    digest = hash_mod_file(source, planned.rel_path)
+    store_object = store_object_path(store_folder, digest)
+    added = add_store_object(source, planned.rel_path, store_object)
+    method = copy_file(store_object, partial, "hardlink")
+    os.replace(partial, dst)
+    if method in ("hardlink", "reflink"):
+        # Report how much content was new, and how much was shared
+        method = "store (new)" if added else "store (shared)"
+    return method, digest, planned
+
+
+# Where every file of a merged mod came from:
+# the merge plan, the content hash of each planned file (or None),
+# and the versions of files that were overridden, by path key
+Provenance = namedtuple("Provenance", "plan hashes overridden")
+
+# Copying many files at once keeps fast drives busy,
+# without overwhelming slow ones too much
+DEFAULT_COPY_WORKERS = min(8, (os.cpu_count() or 1) + 4)
+
+
+# Many Windows systems will error on paths >= 260 characters
+MAX_PATH = 260
+
+# Files in the top level of a merged mod recording where its files came from
+PROVENANCE_FILE = "provenance.sqlite"
+FILE_TO_MOD_MAP_FILE = "file_to_mod_map.txt"
+
+
+# Append-only record of the files copied so far, kept in the merged mod folder
+# until the preserve completes. Its first line describes the preserve itself.
+JOURNAL_FILE = "preserve_journal.jsonl"
+
+
+def read_journal(mod_folder):
+    # Returns the journal's header and its entries by path key
+    header = None
+    entries = {}
+    with (mod_folder / JOURNAL_FILE).open(encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # The last line may have been cut off by a crash
+                break
+            if header is None:
+                header = entry
+            else:
+                entries[path_key(entry["path"])] = entry
+    return header, entries
+
+
+def is_preserved_playset(mod_folder):
+    return (mod_folder / PROVENANCE_FILE).exists() or (
+        mod_folder / FILE_TO_MOD_MAP_FILE
+    ).exists()
+
+
+def read_recorded_provenance(mod_folder):
+    # Read back which mod provided each file of a merged mod, and the file's
+    # hash if known, keyed like the merge plan.
+    # Playsets preserved by older versions only have file_to_mod_map.txt,
+    # and an interrupted first preserve has neither.
+    recorded = {}
+    if (mod_folder / PROVENANCE_FILE).exists():
+        db_connection = sqlite3.connect(mod_folder / PROVENANCE_FILE)
+        sql = (
+            "SELECT f.path, m.displayName, f.hash"
+            " FROM files AS f JOIN mods AS m ON f.mod_index = m.mod_index;"
+        )
+        for path, display_name, digest in db_connection.execute(sql):
+            recorded[path_key(path)] = (display_name, digest)
+        db_connection.close()
+    elif (mod_folder / FILE_TO_MOD_MAP_FILE).exists():
+        with (mod_folder / FILE_TO_MOD_MAP_FILE).open(encoding="utf-8") as f:
+            for line in f:
+                file, sep, mod = line.rstrip("\n").rpartition(" <- [")
+                if sep:
+                    recorded[path_key(Path(file).as_posix())] = (mod[:-1], None)
+    return recorded
+
+
+def remove_unplanned_files(mod_folder, plan):
+    # Delete files left in the merged mod folder by an earlier preserve
+    # that no longer belong to it, along with directories left empty.
+    # Top-level files are rewritten separately.
+    planned_keys = {path_key(planned.rel_path) for planned in plan}
+    removed = 0
+    for root, dirs, files in os.walk(mod_folder, topdown=False):
+        rel_root = Path(root).relative_to(mod_folder).as_posix()
+        if rel_root == ".":
+            break
+        for name in files:
+            if path_key(f"{rel_root}/{name}") not in planned_keys:
+                os.remove(os.path.join(root, name))
+                removed += 1
+        if not os.listdir(root):
+            os.rmdir(root)
+    return removed
+
+
+def plan_playset(mods, ck3_directory, scan_cache=None):
+    # Work out the winning version of every file up front,
+    # so each file in the merged mod is written exactly once
+    sources = open_mod_sources(mods)
+    try:
+        replace_paths = read_mod_replace_paths(mods, ck3_directory)
+        listings = list_mod_files(mods, sources, scan_cache)
+        start = time.perf_counter()
+        merge_plan = plan_merge(listings, replace_paths)
+        log_timing("plan", start, files=len(merge_plan.files))
+        if scan_cache is not None:
+            record_playset_size(scan_cache, mods, merge_plan)
+        return merge_plan
+    finally:
+        close_mod_sources(sources)
+
+
+def longest_destination_path(merge_plan, new_mod_folder):
+    # Length of the longest path the merged mod will contain, counting the
+    # suffix each file has while it's being written.
+    # The top-level files written besides the plan are all short.
+    if not merge_plan.files:
+        return len(str(new_mod_folder))
+    longest = max(
+        len(str(new_mod_folder / planned.rel_path)) for planned in merge_plan.files
+    )
+    return longest + len(PARTIAL_SUFFIX)
+
+
+def estimate_bytes_to_write(
+    mods, merge_plan, new_mod_folder, link_strategy, update, pack=False
+):
+    # Upper bound of the disk space the copy will take.
+    # With pack, the archive exists alongside the folder until it's complete.
+    if link_strategy == "hardlink":
+        # Links take no space, but only work within one volume
+        device = os.stat(new_mod_folder.parent).st_dev
+        linkable = [
+            bool(mod["dirPath"]) and os.stat(mod["dirPath"]).st_dev == device
+            for mod in mods
+        ]
+    else:
+        linkable = [False] * len(mods)
+    required_bytes = 0
+    for planned in merge_plan.files:
+        if linkable[planned.mod_index]:
+            continue
+        if update:
+            # Files that already have the right size are most likely unchanged,
+            # and other files replace what's there
+            try:
+                existing_size = (new_mod_folder / planned.rel_path).stat().st_size
+            except FileNotFoundError:
+                existing_size = 0
+            if existing_size == planned.size:
+                continue
+            required_bytes += max(0, planned.size - existing_size)
+        else:
+            required_bytes += planned.size
+    if pack:
+        required_bytes += sum(planned.size for planned in merge_plan.files)
+    return required_bytes
+
+
+def print_merge_plan(mods, merge_plan, new_mod_folder, per_mod=False, list_files=False):
+    # Describe what a preserve would do, without doing it
+    mod_files = Counter()
+    mod_bytes = Counter()
+    for planned in merge_plan.files:
+        mod_files[planned.mod_index] += 1
+        mod_bytes[planned.mod_index] += planned.size
+    if list_files:
+        for planned in sorted(merge_plan.files, key=lambda planned: planned.rel_path):
+            print(f"{planned.rel_path} <- [{mods[planned.mod_index]['displayName']}]")
+        print()
+    if per_mod:
+        print(f"{'Mod':<40} {'Files':>9} {'Size':>10}")
+        for i, mod in enumerate(mods):
+            print(
+                f"{mod['displayName'][:40]:<40} {mod_files[i]:>9}"
+                f" {format_size(mod_bytes[i]):>10}"
+            )
+        print()
+    planned_bytes = sum(mod_bytes.values())
+    print(
+        f"{len(merge_plan.files)} files ({format_size(planned_bytes)}) would be"
+        f" copied to {new_mod_folder}."
+        f"\n{format_size(merge_plan.scanned_bytes - planned_bytes)} of files"
+        " are overridden or not part of the merged mod."
+    )
+
+
+def path_length_excess(merge_plan, new_mod_folder):
+    # How many characters too long for Windows the longest path
+    # in the merged mod would be
+    if platform.system() != "Windows":
+        return 0
+    return max(0, longest_destination_path(merge_plan, new_mod_folder) - MAX_PATH + 1)
+
+
+def check_disk_space(required_bytes, folder):
+    free_bytes = shutil.disk_usage(folder).free
+    print(
+        f"Disk space required: up to {format_size(required_bytes)}"
+        f" ({format_size(free_bytes)} free)"
+    )
+    if required_bytes > free_bytes:
+        print(
+            "ERROR: Not enough disk space."
+            f" Free up {format_size(required_bytes - free_bytes)} and try again."
+        )
+        return False
+    return True
+
+
+def ask_shorter_folder_name(new_mod_folder, shorter_by):
+    print()
+    print(
+        "WARNING: The preserved playset would contain paths too long for Windows."
+        f'\nWith the mod folder name "{new_mod_folder.name}",'
+        f"\nthe longest path would be {shorter_by + MAX_PATH - 1} characters long."
+    )
+    while True:
+        new_path_input = input(
+            f"\nEnter a new folder name at least {shorter_by} characters shorter,"
+            "\nor press Enter to exit: "
+        ).strip()
+        if not new_path_input:
+            return None
+        elif "\t" in new_path_input:
+            print("ERROR: Folder name cannot contain tab character")
+        elif new_path_input.endswith("."):
+            print("ERROR: Folder name cannot end with .")
+        elif matches := re.findall(r'[*"/:<>?\\|]', new_path_input):
+            print(f"ERROR: Folder name cannot contain {''.join(matches)}")
+        elif len(new_mod_folder.name) - len(new_path_input) < shorter_by:
+            print(f"ERROR: Folder name must be at least {shorter_by} characters shorter")
+        else:
+            replacement_folder = new_mod_folder.parent / new_path_input
+            dotmod = replacement_folder.with_name(f"{new_path_input}.mod")
+            if replacement_folder.exists() or dotmod.exists():
+                print(f'ERROR: "{new_path_input}" already exists.')
+            else:
+                return replacement_folder
+
+
+def format_rate(num_bytes, seconds):
+    # Avoid dividing by zero for copies too quick to time
+    return f"{format_size(num_bytes / max(seconds, 1e-6))}/s"
+
+
+def report_mod_copied(pbar, mod, start, files, num_bytes):
+    # Called once the last file of a mod has been copied
+    seconds = time.perf_counter() - start
+    if files:
+        pbar.write(
+            f"Copied {mod['displayName']}: {files} files ({format_size(num_bytes)})"
+            f" in {seconds:.1f} s, {format_rate(num_bytes, seconds)}"
+        )
+    else:
+        pbar.write(f"{mod['displayName']} is up to date.")
+    log_timing(
+        "copy_mod", start, mod=mod["gameRegistryId"], files=files, bytes=num_bytes
+    )
+
+
+def copy_mod_folders(
+    mods,
+    new_mod_folder,
+    merge_plan=None,
+    workers=DEFAULT_COPY_WORKERS,
+    link_strategy="reflink",
+    update=False,
+    compare_hashes=False,
+    journal_header=None,
+    store_folder=None,
+):
+    # merge_plan is planned here if not given.
+    # With update, new_mod_folder is an existing merged mod to bring up to date:
+    # only files that differ from the plan are copied, and files that are no
+    # longer part of it are deleted.
+    # With journal_header, every copied file is recorded in the journal,
+    # and files an interrupted run already recorded there aren't copied again.
+    # With store_folder, files are linked from that content store,
+    # and link_strategy is ignored.
+    copy_start = time.perf_counter()
+    tqdm_kwargs = {
+        "ascii": should_use_ascii(),
+        "unit": "B",
+        "unit_scale": True,
+        "unit_divisor": 1024,
+    }
+
+    if merge_plan is None:
+        merge_plan = plan_playset(mods, new_mod_folder.parent.parent)
+    plan = merge_plan.files
+
+    if update:
+        compare = "hash" if compare_hashes else "mtime"
+        # Files whose providing mod changed are compared by content,
+        # as the old and new versions may have the same size and date
+        recorded = read_recorded_provenance(new_mod_folder)
+    else:
+        # Create the directory
+        new_mod_folder.mkdir()
+
+    # Content hash of each planned file, where computed
+    hashes = [None] * len(plan)
+    # Files and bytes per copy method
+    method_files = Counter()
+    method_bytes = Counter()
+    # Files that already matched, which weren't rewritten
+    unchanged_files = 0
+    unchanged_bytes = 0
+
+    # Plan entries still to be copied, in load order.
+    # Every entry has a different destination, so the copies are
+    # independent of each other and may finish in any order.
+    pending = deque(range(len(plan)))
+    journal = None
+    if journal_header is not None:
+        journal_path = new_mod_folder / JOURNAL_FILE
+        if journal_path.exists():
+            # Resuming: skip files that were copied from the same source
+            _, journaled = read_journal(new_mod_folder)
+            pending.clear()
+            for index, planned in enumerate(plan):
+                entry = journaled.get(path_key(planned.rel_path))
+                if entry and [entry["mod"], entry["size"], entry["mtime_ns"]] == [
+                    mods[planned.mod_index]["gameRegistryId"],
+                    planned.size,
+                    planned.mtime_ns,
+                ]:
+                    hashes[index] = entry["hash"]
+                else:
+                    pending.append(index)
+            journal = journal_path.open("a", encoding="utf-8", buffering=1)
+            resumed_files = len(plan) - len(pending)
+            print(f"Resuming: {resumed_files} files were already copied.")
+        else:
+            # Line-buffered, so every completed file is recorded right away
+            journal = journal_path.open("w", encoding="utf-8", buffering=1)
+            journal.write(json.dumps(journal_header) + "\n")
+
+    # Progress is measured in bytes, so that big files move the bar more
+    planned_bytes = sum(planned.size for planned in plan)
+    done_files = len(plan) - len(pending)
+    done_bytes = planned_bytes - sum(plan[index].size for index in pending)
+    # Files still to come, when the first one started, and the files and
+    # bytes written, for each mod
+    mod_remaining = Counter(plan[index].mod_index for index in pending)
+    mod_start = {}
+    mod_files = Counter()
+    mod_bytes = Counter()
+
+    sources = open_mod_sources(mods)
+    try:
+        pbar = tqdm(total=planned_bytes, initial=done_bytes, **tqdm_kwargs)
+        pbar.set_postfix_str(f"{done_files}/{len(plan)} files")
+        in_flight = {}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while pending or in_flight:
+                # Only keep a few copies queued, so that the progress
+                # messages follow the copy and errors stop it promptly
+                while pending and len(in_flight) < 2 * workers:
+                    index = pending.popleft()
+                    planned = plan[index]
+                    mod = mods[planned.mod_index]
+                    mod_start.setdefault(planned.mod_index, time.perf_counter())
+                    recorded_name, recorded_hash = None, None
+                    if not update:
+                        file_compare = None
+                    else:
+                        recorded_name, recorded_hash = recorded.get(
+                            path_key(planned.rel_path), (None, None)
+                        )
+                        if recorded_name == mod["displayName"]:
+                            file_compare = compare
+                        else:
+                            file_compare = "hash"
+                    future = executor.submit(
+                        copy_planned_file,
+                        sources[planned.mod_index],
+                        planned,
+                        new_mod_folder,
+                        link_strategy,
+                        file_compare,
+                        recorded_hash,
+                        store_folder,
+                    )
+                    in_flight[future] = index
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = in_flight.pop(future)
+                    method, hashes[index], planned = future.result()
+                    if planned != plan[index]:
+                        # Changed since it was listed. The manifest and
+                        # journal record the version copied.
+                        plan.set_stat(index, planned.size, planned.mtime_ns)
+                    if journal:
+                        entry = {
+                            "path": planned.rel_path,
+                            "mod": mods[planned.mod_index]["gameRegistryId"],
+                            "size": planned.size,
+                            "mtime_ns": planned.mtime_ns,
+                            "hash": hashes[index],
+                        }
+                        journal.write(json.dumps(entry) + "\n")
+                    if method:
+                        method_files[method] += 1
+                        method_bytes[method] += planned.size
+                        mod_files[planned.mod_index] += 1
+                        mod_bytes[planned.mod_index] += planned.size
+                    else:
+                        unchanged_files += 1
+                        unchanged_bytes += planned.size
+                    done_files += 1
+                    pbar.set_postfix_str(
+                        f"{done_files}/{len(plan)} files", refresh=False
+                    )
+                    pbar.update(planned.size)
+                    mod_remaining[planned.mod_index] -= 1
+                    if not mod_remaining[planned.mod_index]:
+                        report_mod_copied(
+                            pbar,
+                            mods[planned.mod_index],
+                            mod_start[planned.mod_index],
+                            mod_files[planned.mod_index],
+                            mod_bytes[planned.mod_index],
+                        )
+        pbar.close()
+    finally:
+        close_mod_sources(sources)
+        if journal:
+            journal.close()
+
+    print(
+        f"Copied {sum(method_files.values())} files"
+        f" ({format_size(sum(method_bytes.values()))})."
+        f"\nSkipped {format_size(merge_plan.scanned_bytes - planned_bytes)} of files"
+        " that are overridden or not part of the merged mod."
+    )
+    for method, count in method_files.most_common():
+        print(f"- {method}: {count} files ({format_size(method_bytes[method])})")
+    if update:
+        removed_files = remove_unplanned_files(new_mod_folder, plan)
+        print(
+            f"{unchanged_files} files ({format_size(unchanged_bytes)})"
+            " were already up to date, and not rewritten."
+        )
+        print(f"Deleted {removed_files} files that are no longer part of the playset.")
+    log_timing(
+        "copy",
+        copy_start,
+        files=sum(method_files.values()),
+        bytes=sum(method_bytes.values()),
+        unchanged_files=unchanged_files,
+        unchanged_bytes=unchanged_bytes,
+        workers=workers,
+    )
+
+    # This is used to generate the provenance manifest later
+    return Provenance(plan, hashes, merge_plan.overridden)
+
+
+def compare_overridden_versions(sources, winner, losers, known_hashes=None):
+    # For each overridden version of a file, whether the winning version
+    # actually differs from it. Sizes are compared first, so only files of
+    # equal size are read, and the winner is read at most once.
+    # known_hashes maps (mod index, path) to (size, mtime in ns, content hash)
+    # already known, which only hold while the file still has that size and
+    # date. The hashes computed here are added to it.
+    if known_hashes is None:
+        known_hashes = {}
+    # The plan may come from a cached listing, which misses files changed
+    # in place, so the files are checked as they are now
+    stats = {}
+
+    def get_stat(planned):
+        if planned not in stats:
+            stats[planned] = stat_mod_file(sources[planned.mod_index], planned.rel_path)
+        return stats[planned]
+
+    def get_hash(planned):
+        key = (planned.mod_index, planned.rel_path)
+        stat = get_stat(planned)
+        known = known_hashes.get(key)
+        if known is None or known[:2] != stat:
+            digest = hash_mod_file(sources[planned.mod_index], planned.rel_path)
+            known = known_hashes[key] = (*stat, digest)
+        return known[2]
+
+    changed = []
+    for loser in losers:
+        if get_stat(loser)[0] != get_stat(winner)[0]:
+            changed.append(True)
+        else:
+            changed.append(get_hash(loser) != get_hash(winner))
+    return changed
+
+
+def analyze_conflicts(
+    mods, ck3_directory, workers=DEFAULT_COPY_WORKERS, scan_cache=None
+):
+    # Find every file provided by more than one mod, without copying anything.
+    # Returns (winner, losers, changed) for each such file,
+    # with changed as from compare_overridden_versions.
+    # With scan_cache, file hashes from earlier analyses are reused.
+    sources = open_mod_sources(mods)
+    known_hashes = {}
+    try:
+        replace_paths = read_mod_replace_paths(mods, ck3_directory)
+        listings = list_mod_files(mods, sources, scan_cache)
+        merge_plan = plan_merge(listings, replace_paths)
+        if scan_cache is not None:
+            for mod_index, mod in enumerate(mods):
+                for rel_path, known in get_cached_hashes(scan_cache, mod).items():
+                    known_hashes[mod_index, rel_path] = known
+        winners = {path_key(planned.rel_path): planned for planned in merge_plan.files}
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                (
+                    winners[key],
+                    losers,
+                    executor.submit(
+                        compare_overridden_versions,
+                        sources,
+                        winners[key],
+                        losers,
+                        known_hashes,
+                    ),
+                )
+                for key, losers in merge_plan.overridden.items()
+            ]
+            conflicts = [(winner, losers, f.result()) for winner, losers, f in futures]
+    finally:
+        close_mod_sources(sources)
+    if scan_cache is not None:
+        for mod_index, mod in enumerate(mods):
+            hashes = {
+                rel_path: known
+                for (index, rel_path), known in known_hashes.items()
+                if index == mod_index
+            }
+            record_cached_hashes(scan_cache, mod, hashes)
+    return conflicts
+
+
+def print_conflict_report(mods, conflicts, details=False):
+    # Per mod: versions of other mods' files it overrides, how many of those
+    # it changes and leaves identical, bytes it shadows,
+    # and how many of its own files are overridden
+    stats = [[0, 0, 0, 0, 0] for _ in mods]
+    for winner, losers, changed in conflicts:
+        winner_stats = stats[winner.mod_index]
+        for loser, loser_changed in zip(losers, changed):
+            winner_stats[0] += 1
+            winner_stats[1 if loser_changed else 2] += 1
+            winner_stats[3] += loser.size
+            stats[loser.mod_index][4] += 1
+
+    if details:
+        for winner, losers, changed in sorted(
+            conflicts, key=lambda conflict: conflict[0].rel_path
+        ):
+            overrides = ", ".join(
+                f"[{mods[loser.mod_index]['displayName']}]"
+                + ("" if loser_changed else " (identical)")
+                for loser, loser_changed in zip(losers, changed)
+            )
+            print(
+                f"{winner.rel_path} <- [{mods[winner.mod_index]['displayName']}]"
+                f" overrides {overrides}"
+            )
+        print()
+
+    # Rank mods by how much of the others they override
+    ranking = sorted(
+        (i for i, mod_stats in enumerate(stats) if any(mod_stats)),
+        key=lambda i: (stats[i][0], stats[i][3]),
+        reverse=True,
+    )
+    print(
+        f"{'Mod':<40} {'Overrides':>9} {'Changed':>9} {'Identical':>9}"
+        f" {'Shadowed':>10} {'Overridden':>10}"
+    )
+    for i in ranking:
+        overrides, changed, identical, shadowed, lost = stats[i]
+        print(
+            f"{mods[i]['displayName'][:40]:<40} {overrides:>9} {changed:>9}"
+            f" {identical:>9} {format_size(shadowed):>10} {lost:>10}"
+        )
+    print()
+    print(
+        f"{len(conflicts)} files are provided by more than one mod."
+        f"\n{sum(mod_stats[2] for mod_stats in stats)} overrides leave the file"
+        " identical to the version they override."
+    )
+
+
+def clean_combined_folder(destination_path):
+    # A mess of thumbnails and READMEs wind up at the top of the mod folder.
+    # Remove all of them, except the journal of the preserve in progress
+    for item in destination_path.iterdir():
+        if item.is_file() and item.name != JOURNAL_FILE:
+            item.unlink()
+
+
+def get_mod_archive(mod_folder):
+    # Where a merged mod packed into one archive is kept
+    return mod_folder.with_name(f"{mod_folder.name}.zip")
+
+
+def create_dotmod_files(new_mod_folder, new_mod_name, game_version, mods, packed=False):
+    # With packed, the <name>.mod file points to the merged mod's archive
+    # instead of its folder
+    # Gather mod tags from already-fetched data
+    # and replace_path lines from their .mod files
+    tags = set()
+    replace_paths = set()
+    for mod in mods:
+        # The tags column from the DB is JSON. There should never be
+        # quotation marks inside the tags, but escape them just in case.
+        tags.update(tag.replace('"', '\\"') for tag in json.loads(mod["tags"]))
+        src_mod_file_path = get_mod_descriptor(mod, new_mod_folder.parent.parent)
+        replace_paths.update(read_replace_paths(src_mod_file_path))
+
+    escaped_name = new_mod_name.replace('"', '\\"')
+    escaped_game_version = game_version.replace('"', '\\"')
+    lines = [
+        'version="1.0.0"',
+        "tags={",
+        *(f'\t"{tag}"' for tag in sorted(tags)),
+        "}",
+        f'name="{escaped_name}"',
+        f'supported_version="{escaped_game_version}"',
+        path_line := (
+            f'archive="mod/{get_mod_archive(new_mod_folder).name}"'
+            if packed
+            else f'path="mod/{new_mod_folder.name}"'
+        ),
+        *(f'replace_path="{path}"' for path in sorted(replace_paths)),
+    ]
+
+    # UTF-8 encoding, LF line endings
+    mod_file_path = new_mod_folder.with_name(f"{new_mod_folder.name}.mod")
+    with mod_file_path.open("w", encoding="utf-8", newline="") as file:
+        file.writelines(x + "\n" for x in lines)
+
+    # descriptor.mod normally lacks the path line
+    lines.remove(path_line)
+
+    descriptor_path = new_mod_folder / "descriptor.mod"
+    with descriptor_path.open("w", encoding="utf-8", newline="") as file:
+        file.writelines(x + "\n" for x in lines)
+
+
+def write_provenance_manifest(manifest_path, mods, provenance):
+    # Mods are stored once and referenced by their position in the load order.
+    # Written to a temporary file first, so a failure never leaves
+    # a half-written manifest behind.
+    tmp_path = manifest_path.with_name(f"{manifest_path.name}.tmp")
+    tmp_path.unlink(missing_ok=True)
+    db_connection = sqlite3.connect(tmp_path)
+    db_connection.executescript(
+        """
+        CREATE TABLE mods (
+            mod_index INTEGER PRIMARY KEY,
+            gameRegistryId TEXT,
+            displayName TEXT,
+            version TEXT
+        );
+        CREATE TABLE files (
+            path TEXT PRIMARY KEY,
+            mod_index INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            hash TEXT
+        ) WITHOUT ROWID;
+        CREATE TABLE overridden (
+            path TEXT NOT NULL,
+            mod_index INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            PRIMARY KEY (path, mod_index)
+        ) WITHOUT ROWID;
+        """
+    )
+    db_connection.executemany(
+        "INSERT INTO mods VALUES (?, ?, ?, ?);",
+        (
+            (i, mod["gameRegistryId"], mod["displayName"], mod["version"])
+            for i, mod in enumerate(mods)
+        ),
+    )
+    db_connection.executemany(
+        "INSERT INTO files VALUES (?, ?, ?, ?, ?);",
+        (
+            (planned.rel_path, planned.mod_index, planned.size, planned.mtime_ns, digest)
+            for planned, digest in zip(provenance.plan, provenance.hashes)
+        ),
+    )
+    # Overridden versions are recorded under the path of the winning version.
+    # Only those paths are collected, not a second copy of every path.
+    winner_paths = {}
+    for planned in provenance.plan:
+        key = path_key(planned.rel_path)
+        if key in provenance.overridden:
+            winner_paths[key] = planned.rel_path
+    db_connection.executemany(
+        "INSERT OR IGNORE INTO overridden VALUES (?, ?, ?);",
+        (
+            (winner_paths[key], loser.mod_index, loser.size)
+            for key, losers in provenance.overridden.items()
+            for loser in losers
+        ),
+    )
+    # Lookups are case-insensitive, like paths on Windows
+    db_connection.execute(
+        "CREATE INDEX files_path_nocase ON files (path COLLATE NOCASE);"
+    )
+    db_connection.commit()
+    db_connection.close()
+    os.replace(tmp_path, manifest_path)
+
+
+def export_file_to_mod_map(manifest_path, map_path):
+    # Plain text version of the manifest, sorted by path
+    db_connection = sqlite3.connect(manifest_path)
+    sql = (
+        "SELECT f.path, m.displayName"
+        " FROM files AS f JOIN mods AS m ON f.mod_index = m.mod_index"
+        " ORDER BY f.path;"
+    )
+    with map_path.open("w", encoding="utf-8") as f:
+        for path, display_name in db_connection.execute(sql):
+            print(f"{path.replace('/', os.sep)} <- [{display_name}]", file=f)
+    db_connection.close()
+
+
+# Formats that are compressed already, or barely compress,
+# which are stored in archives as they are
+STORED_EXTENSIONS = {
+    ".bank",
+    ".bk2",
+    ".dds",
+    ".jpeg",
+    ".jpg",
+    ".mesh",
+    ".mp3",
+    ".ogg",
+    ".png",
+    ".zip",
+}
+
+# Bytes of files being compressed at once while packing. A file larger than
+# this is compressed alone.
+PACK_BYTES_IN_FLIGHT = 256 * 1024 * 1024
+
+# Records of the zip format, as documented in PKWARE's APPNOTE.TXT
+ZIP_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+ZIP_CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+ZIP64_END_RECORD = struct.Struct("<4sQ2H2L4Q")
+ZIP64_END_LOCATOR = struct.Struct("<4sLQL")
+ZIP_END_RECORD = struct.Struct("<4s4H2LH")
+# Sizes and offsets from here on are moved to ZIP64 extra fields. Like zipfile,
+# stay below 2 GiB for readers that take the 32-bit fields as signed.
+ZIP64_LIMIT = (1 << 31) - 1
+ZIP_COUNT_LIMIT = 0xFFFF
+
+
+class ZipArchiveWriter:
+    # Writes a zip archive from members compressed elsewhere, which zipfile
+    # can't do, so that files can be compressed on several cores at once.
+    # Only what packing needs: stored and deflated files, no directories.
+
+    def __init__(self, file):
+        self.file = file
+        self.central_headers = []
+
+    def write_member(self, info, compress_type, crc, size, chunks):
+        # Add a member given its CRC, uncompressed size and data as written
+        compress_size = sum(len(chunk) for chunk in chunks)
+        offset = self.file.tell()
+        self.file.write(self.local_header(info, compress_type, crc, size, compress_size))
+        for chunk in chunks:
+            self.file.write(chunk)
+        self.add_central_header(info, compress_type, crc, size, compress_size, offset)
+
+    def write_stored_file(self, info, path):
+        # Add a file as it is, streamed from disk. The CRC is only known
+        # afterwards, so the local header is written again once it is.
+        offset = self.file.tell()
+        self.file.write(self.local_header(info, zipfile.ZIP_STORED, 0, info.file_size))
+        crc = size = 0
+        with path.open("rb") as f:
+            while chunk := f.read(1024 * 1024):
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                self.file.write(chunk)
+        if size != info.file_size:
+            raise OSError(f"{path} changed while it was being packed")
+        end = self.file.tell()
+        self.file.seek(offset)
+        self.file.write(self.local_header(info, zipfile.ZIP_STORED, crc, size))
+        self.file.seek(end)
+        self.add_central_header(info, zipfile.ZIP_STORED, crc, size, size, offset)
+
+    def close(self):
+        # Write the central directory, with ZIP64 end records if needed
+        offset = self.file.tell()
+        for header in self.central_headers:
+            self.file.write(header)
+        count = len(self.central_headers)
+        directory_size = self.file.tell() - offset
+        if (
+            count >= ZIP_COUNT_LIMIT
+            or offset > ZIP64_LIMIT
+            or directory_size > ZIP64_LIMIT
+        ):
+            end_offset = self.file.tell()
+            self.file.write(
+                ZIP64_END_RECORD.pack(
+                    b"PK\x06\x06",
+                    ZIP64_END_RECORD.size - 12,
+                    45,
+                    45,
+                    0,
+                    0,
+                    count,
+                    count,
+                    directory_size,
+                    offset,
+                )
+            )
+            self.file.write(ZIP64_END_LOCATOR.pack(b"PK\x06\x07", 0, end_offset, 1))
+            count = min(count, 0xFFFF)
+            offset = min(offset, 0xFFFFFFFF)
+            directory_size = min(directory_size, 0xFFFFFFFF)
+        self.file.write(
+            ZIP_END_RECORD.pack(
+                b"PK\x05\x06", 0, 0, count, count, directory_size, offset, 0
+            )
+        )
+
+    @staticmethod
+    def encode_name(info):
+        # Names that aren't ASCII are UTF-8, which flag bit 11 says
+        try:
+            return info.filename.encode("ascii"), 0
+        except UnicodeEncodeError:
+            return info.filename.encode("utf-8"), 0x800
+
+    @staticmethod
+    def dos_date_time(info):
+        year, month, day, hour, minute, second = info.date_time
+        return (
+            (year - 1980) << 9 | month << 5 | day,
+            hour << 11 | minute << 5 | second // 2,
+        )
+
+    def local_header(self, info, compress_type, crc, size, compress_size=None):
+        compress_size = size if compress_size is None else compress_size
+        name, flags = self.encode_name(info)
+        dos_date, dos_time = self.dos_date_time(info)
+        extra = b""
+        version = 20
+        if size > ZIP64_LIMIT or compress_size > ZIP64_LIMIT:
+            # Local ZIP64 extra fields always hold both sizes
+            extra = struct.pack("<2H2Q", 1, 16, size, compress_size)
+            size = compress_size = 0xFFFFFFFF
+            version = 45
+        return (
+            ZIP_LOCAL_HEADER.pack(
+                b"PK\x03\x04",
+                version,
+                flags,
+                compress_type,
+                dos_time,
+                dos_date,
+                crc,
+                compress_size,
+                size,
+                len(name),
+                len(extra),
+            )
+            + name
+            + extra
+        )
+
+    def add_central_header(self, info, compress_type, crc, size, compress_size, offset):
+        name, flags = self.encode_name(info)
+        dos_date, dos_time = self.dos_date_time(info)
+        # Central ZIP64 extra fields only hold the values that don't fit
+        large = []
+        if size > ZIP64_LIMIT:
+            large.append(size)
+            size = 0xFFFFFFFF
+        if compress_size > ZIP64_LIMIT:
+            large.append(compress_size)
+            compress_size = 0xFFFFFFFF
+        if offset > ZIP64_LIMIT:
+            large.append(offset)
+            offset = 0xFFFFFFFF
+        extra = b""
+        version = 20
+        if large:
+            extra = struct.pack(f"<2H{len(large)}Q", 1, 8 * len(large), *large)
+            version = 45
+        self.central_headers.append(
+            ZIP_CENTRAL_HEADER.pack(
+                b"PK\x01\x02",
+                info.create_system << 8 | version,
+                version,
+                flags,
+                compress_type,
+                dos_time,
+                dos_date,
+                crc,
+                compress_size,
+                size,
+                len(name),
+                len(extra),
+                0,
+                0,
+                0,
+                info.external_attr,
+                offset,
+            )
+            + name
+            + extra
+        )
+
+
+def compress_file(path):
+    # Runs on the packing thread pool. zlib releases the GIL while
+    # compressing, so files are compressed on several cores at once.
+    # The file is read a chunk at a time, so only its compressed data is held.
+    # Returns the CRC, size and raw deflate stream of the file, in chunks.
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    crc = size = 0
+    chunks = []
+    with path.open("rb") as f:
+        while chunk := f.read(1024 * 1024):
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            if compressed := compressor.compress(chunk):
+                chunks.append(compressed)
+    chunks.append(compressor.flush())
+    return crc, size, chunks
+
+
+def pack_mod_folder(mod_folder, archive_path, workers=DEFAULT_COPY_WORKERS):
+    # Write every file of a merged mod to one zip archive,
+    # except the journal of the preserve in progress
+    start = time.perf_counter()
+    paths = []
+    for root, dirs, names in os.walk(mod_folder):
+        dirs.sort()
+        for name in sorted(names):
+            if root != str(mod_folder) or name != JOURNAL_FILE:
+                paths.append(Path(root, name))
+    total_bytes = sum(path.stat().st_size for path in paths)
+
+    partial = archive_path.with_name(archive_path.name + PARTIAL_SUFFIX)
+    pbar = tqdm(
+        total=total_bytes,
+        ascii=should_use_ascii(),
+        unit="B",
+        unit_scale=True,
+        unit_divisor=1024,
+    )
+    with partial.open("wb") as f, ThreadPoolExecutor(max_workers=workers) as executor:
+        archive = ZipArchiveWriter(f)
+        in_flight = {}
+        in_flight_bytes = 0
+
+        def write_done(return_when):
+            nonlocal in_flight_bytes
+            done, _ = wait(in_flight, return_when=return_when)
+            for future in done:
+                info = in_flight.pop(future)
+                crc, size, chunks = future.result()
+                archive.write_member(info, zipfile.ZIP_DEFLATED, crc, size, chunks)
+                in_flight_bytes -= info.file_size
+                pbar.update(size)
+
+        for path in paths:
+            arcname = path.relative_to(mod_folder).as_posix()
+            # ZIP can't represent dates before 1980, which are clamped
+            info = zipfile.ZipInfo.from_file(path, arcname, strict_timestamps=False)
+            if path.suffix.lower() in STORED_EXTENSIONS:
+                # Streamed as they are, while the pool compresses others
+                archive.write_stored_file(info, path)
+                pbar.update(info.file_size)
+                continue
+            # Compressed files are held in memory until written,
+            # so only so many bytes of files are kept in flight
+            while in_flight and (
+                len(in_flight) >= 2 * workers
+                or in_flight_bytes + info.file_size > PACK_BYTES_IN_FLIGHT
+            ):
+                write_done(FIRST_COMPLETED)
+            in_flight[executor.submit(compress_file, path)] = info
+            in_flight_bytes += info.file_size
+        while in_flight:
+            write_done(FIRST_COMPLETED)
+        archive.close()
+    pbar.close()
+    os.replace(partial, archive_path)
+    log_timing("pack", start, files=len(paths), bytes=total_bytes)
+    print(
+        f"Packed {len(paths)} files ({format_size(total_bytes)}) into"
+        f" {archive_path.name} ({format_size(archive_path.stat().st_size)})."
+    )
+
+
+def preserve_playset(
+    mods,
+    playset,
+    new_mod_folder,
+    new_mod_name,
+    game_version,
+    merge_plan,
+    link_strategy="reflink",
+    update=False,
+    compare_hashes=False,
+    workers=DEFAULT_COPY_WORKERS,
+    use_store=False,
+    scan_cache=None,
+    pack=False,
+):
+    # Copy the planned files and write the merged mod's own files.
+    # Progress is journaled, so an interrupted preserve can be resumed
+    # by running this again with update.
+    # With pack, the merged mod is then packed into one archive,
+    # which replaces its folder.
+    # With use_store, files are linked from the content store
+    # shared by the merged mods in the same mod directory.
+    # With scan_cache, the hashes of the copied files are remembered there.
+    journal_header = {
+        "name": new_mod_name,
+        "game_version": game_version,
+        "playset_id": playset["id"],
+        "playset_name": playset["name"],
+        "link_strategy": link_strategy,
+        "compare_hashes": compare_hashes,
+        "use_store": use_store,
+        "pack": pack,
+        "update": update,
+    }
+    start = time.perf_counter()
+    provenance = copy_mod_folders(
+        mods,
+        new_mod_folder,
+        merge_plan,
+        workers=workers,
+        link_strategy=link_strategy,
+        update=update,
+        compare_hashes=compare_hashes,
+        journal_header=journal_header,
+        store_folder=new_mod_folder.parent / STORE_FOLDER if use_store else None,
+    )
+    if scan_cache is not None and not update:
+        # Updates skip unchanged files, so only full copies show the copy rate
+        planned_bytes = sum(planned.size for planned in provenance.plan)
+        record_copy_rate(scan_cache, planned_bytes, time.perf_counter() - start)
+
+    # Clean up the combined folder
+    start = time.perf_counter()
+    clean_combined_folder(new_mod_folder)
+
+    # Create the <name>.mod and descriptor.mod files
+    create_dotmod_files(new_mod_folder, new_mod_name, game_version, mods, pack)
+    log_timing("descriptors", start)
+
+    start = time.perf_counter()
+    create_mod_version_files(new_mod_folder, playset, mods, provenance)
+    log_timing("manifest", start, files=len(provenance.plan))
+
+    if scan_cache is not None:
+        mod_hashes = [{} for _ in mods]
+        for planned, digest in zip(provenance.plan, provenance.hashes):
+            if digest:
+                mod_hashes[planned.mod_index][planned.rel_path] = (
+                    planned.size,
+                    planned.mtime_ns,
+                    digest,
+                )
+        for mod, hashes in zip(mods, mod_hashes):
+            record_cached_hashes(scan_cache, mod, hashes)
+
+    if pack:
+        pack_mod_folder(new_mod_folder, get_mod_archive(new_mod_folder), workers)
+        # The journal goes with the folder
+        shutil.rmtree(new_mod_folder)
+    else:
+        # Only now is the merged mod complete
+        (new_mod_folder / JOURNAL_FILE).unlink()
+
+
+def create_mod_version_files(
+    new_mod_folder, playset, mods, provenance, export_text=True
+):
+    with (new_mod_folder / "README.txt").open("w", encoding="utf-8") as f:
+        print(
+            "This mod was generated using Crusader Kings 3 Playset Preserver."
+            "\nGitHub repository: https://github.com/Ant0nidas/CK3-Playset-Preserver"
+            "\nCMH Discord: https://discord.gg/GuDjt9YQ",
+            file=f,
+        )
+        print(file=f)
+        print(f"Source playset: {playset['name']}", file=f)
+        print(f"Date: {date.today()}", file=f)
+        print("Contents:", file=f)
+        for mod in mods:
+            print(f"{mod['displayName']} ({mod['version']})", file=f)
+
+    manifest_path = new_mod_folder / PROVENANCE_FILE
+    write_provenance_manifest(manifest_path, mods, provenance)
+    if export_text:
+        export_file_to_mod_map(manifest_path, new_mod_folder / FILE_TO_MOD_MAP_FILE)
+
+
+def resolve_mod_folder(name):
+    # Accept a path, or the name of a folder in the game's mod directory
+    mod_folder = Path(name)
+    if not mod_folder.is_dir() and (ck3_directory := locate_ck3_directory()):
+        mod_folder = ck3_directory / "mod" / name
+    return mod_folder
+
+
+def lookup_files(mod_folder, files):
+    # Answer which mod provides each file of a preserved playset,
+    # using the manifest's indexes instead of reading the whole map
+    manifest_path = mod_folder / PROVENANCE_FILE
+    if not manifest_path.exists():
+        print(f"ERROR: {manifest_path} not found.")
+        return 1
+
+    db_connection = open_db_connection(manifest_path)
+    exit_code = 0
+    for file in files:
+        path = file.replace("\\", "/")
+        while path.startswith("./"):
+            path = path[2:]
+        sql = (
+            "SELECT f.path, f.size, f.mtime_ns, f.hash,"
+            " m.displayName, m.version, m.gameRegistryId"
+            " FROM files AS f JOIN mods AS m ON f.mod_index = m.mod_index"
+            " WHERE f.path = ? COLLATE NOCASE;"
+        )
+        row = db_connection.execute(sql, (path,)).fetchone()
+        if row is None:
+            print(f"{path}: not provided by any mod")
+            exit_code = 1
+            continue
+        print(
+            f"{row['path']} <- [{row['displayName']}]"
+            f" (version {row['version']}, {row['gameRegistryId']})"
+        )
+        modified = datetime.fromtimestamp(row["mtime_ns"] / 1e9).replace(microsecond=0)
+        print(f"    {row['size']} bytes, modified {modified}, hash {row['hash']}")
+        sql = (
+            "SELECT m.displayName FROM overridden AS o"
+            " JOIN mods AS m ON o.mod_index = m.mod_index"
+            " WHERE o.path = ? ORDER BY o.mod_index;"
+        )
+        if losers := db_connection.execute(sql, (row["path"],)).fetchall():
+            print(f"    overrides: {', '.join(f'[{r[0]}]' for r in losers)}")
+    db_connection.close()
+    return exit_code
+
+
+def check_preserved_file(path, size, digest):
+    # Runs on the verification thread pool.
+    # Returns "missing", "corrupted" or None if the file is intact.
+    try:
+        if os.stat(path).st_size != size:
+            return "corrupted"
+    except FileNotFoundError:
+        return "missing"
+    # Manifests written without hashes only allow checking sizes
+    if digest is not None and hash_file(path) != digest:
+        return "corrupted"
+    return None
+
+
+def hash_unchanged_mod_file(source, rel_path, size, mtime_ns):
+    # Runs on the verification thread pool.
+    # The content hash of a mod file if it's still the version recorded
+    # with the given size and date, or else None.
+    try:
+        if stat_mod_file(source, rel_path) != (size, mtime_ns):
+            return None
+        return hash_mod_file(source, rel_path)
+    except FileNotFoundError:
+        return None
+
+
+def fill_missing_hashes(mod_folder, db_path, workers=DEFAULT_COPY_WORKERS):
+    # Files copied without reading them are recorded without hashes.
+    # Hash the ones whose mods still have the preserved version,
+    # and record those hashes in the manifest for later checks.
+    # Returns the number of files still without hashes.
+    db_connection = open_db_connection(mod_folder / PROVENANCE_FILE)
+    sql = (
+        "SELECT f.path, f.size, f.mtime_ns, m.gameRegistryId"
+        " FROM files AS f JOIN mods AS m ON f.mod_index = m.mod_index"
+        " WHERE f.hash IS NULL;"
+    )
+    rows = db_connection.execute(sql).fetchall()
+    if not rows:
+        db_connection.close()
+        return 0
+    launcher_connection = open_db_connection(db_path)
+    sql = "SELECT gameRegistryId, dirPath, archivePath FROM mods;"
+    launcher_mods = {
+        mod["gameRegistryId"]: mod
+        for mod in launcher_connection.execute(sql).fetchall()
+        if mod["archivePath"] or mod["dirPath"]
+    }
+    launcher_connection.close()
+
+    print(f"Hashing {len(rows)} files recorded without hashes...")
+    mods = [
+        launcher_mods[registry_id]
+        for registry_id in {row["gameRegistryId"] for row in rows}
+        if registry_id in launcher_mods
+    ]
+    sources = dict(zip((mod["gameRegistryId"] for mod in mods), open_mod_sources(mods)))
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(
+                    hash_unchanged_mod_file,
+                    sources[row["gameRegistryId"]],
+                    row["path"],
+                    row["size"],
+                    row["mtime_ns"],
+                ): row["path"]
+                for row in rows
+                if row["gameRegistryId"] in sources
+            }
+            hashes = [(future.result(), path) for future, path in futures.items()]
+    finally:
+        close_mod_sources(list(sources.values()))
+    hashes = [(digest, path) for digest, path in hashes if digest is not None]
+    db_connection.executemany("UPDATE files SET hash = ? WHERE path = ?;", hashes)
+    db_connection.commit()
+    db_connection.close()
+    return len(rows) - len(hashes)
+
+
+def verify_mod_folder(mod_folder, workers=DEFAULT_COPY_WORKERS):
+    # Check every file of a preserved playset against its manifest.
+    # Returns the manifest rows of missing and corrupted files,
+    # and the paths of files that aren't part of the playset.
+    db_connection = open_db_connection(mod_folder / PROVENANCE_FILE)
+    sql = (
+        "SELECT f.path, f.size, f.hash, m.gameRegistryId, m.displayName"
+        " FROM files AS f JOIN mods AS m ON f.mod_index = m.mod_index;"
+    )
+    rows = db_connection.execute(sql).fetchall()
+    db_connection.close()
+
+    missing = []
+    corrupted = []
+    pbar = tqdm(
+        total=sum(row["size"] for row in rows),
+        ascii=should_use_ascii(),
+        unit="B",
+        unit_scale=True,
+        unit_divisor=1024,
+    )
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(
+                check_preserved_file, mod_folder / row["path"], row["size"], row["hash"]
+            ): row
+            for row in rows
+        }
+        for future in futures:
+            row = futures[future]
+            problem = future.result()
+            if problem == "missing":
+                missing.append(row)
+            elif problem == "corrupted":
+                corrupted.append(row)
+            pbar.update(row["size"])
+    pbar.close()
+
+    # Top-level files are the merged mod's own, not the mods'
+    planned_keys = {path_key(row["path"]) for row in rows}
+    extra = []
+    for root, dirs, files in os.walk(mod_folder):
+        rel_root = Path(root).relative_to(mod_folder).as_posix()
+        if rel_root == ".":
+            continue
+        for name in files:
+            if path_key(f"{rel_root}/{name}") not in planned_keys:
+                extra.append(f"{rel_root}/{name}")
+    return missing, corrupted, sorted(extra)
+
+
+def repair_mod_folder(mod_folder, damaged, extra, db_path):
+    # Copy missing and corrupted files again from the mods they came from,
+    # if those still have the same version of the file,
+    # and delete files that aren't part of the playset.
+    # Returns the number of files that couldn't be repaired.
+    db_connection = open_db_connection(db_path)
+    sql = "SELECT gameRegistryId, dirPath, archivePath FROM mods;"
+    launcher_mods = {
+        mod["gameRegistryId"]: mod for mod in db_connection.execute(sql).fetchall()
+    }
+    db_connection.close()
+
+    by_mod = {}
+    for row in damaged:
+        by_mod.setdefault(row["gameRegistryId"], []).append(row)
+    unrepaired = 0
+    for game_registry_id, rows in by_mod.items():
+        mod = launcher_mods.get(game_registry_id)
+        if mod is None or not (mod["archivePath"] or mod["dirPath"]):
+            print(f"Can't repair files of {rows[0]['displayName']}, which is gone.")
+            unrepaired += len(rows)
+            continue
+        (source,) = open_mod_sources([mod])
+        try:
+            for row in rows:
+                try:
+                    source_hash = hash_mod_file(source, row["path"])
+                except (FileNotFoundError, KeyError):
+                    source_hash = None
+                if row["hash"] is None or source_hash != row["hash"]:
+                    print(
+                        f"Can't repair {row['path']}: {row['displayName']}"
+                        " no longer has the preserved version."
+                    )
+                    unrepaired += 1
+                    continue
+                dst = mod_folder / row["path"]
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                partial = dst.with_name(dst.name + PARTIAL_SUFFIX)
+                partial.unlink(missing_ok=True)
+                # Replaced rather than written through,
+                # in case the damaged file is a hard link
+                copy_mod_file(source, row["path"], partial, "reflink")
+                os.replace(partial, dst)
+                print(f"Repaired {row['path']}")
+        finally:
+            close_mod_sources([source])
+
+    for rel_path in extra:
+        (mod_folder / rel_path).unlink()
+        print(f"Deleted {rel_path}")
+    return unrepaired
+
+
+# One file of a version of a playset, preserved or live.
+# mod is the gameRegistryId of the mod providing it, hash None if not known.
+SnapshotFile = namedtuple("SnapshotFile", "path mod size mtime_ns hash")
+
+# Ways a file can differ between two versions of a playset
+DIFF_STATUSES = {
+    "A": "added",
+    "D": "removed",
+    "M": "modified",
+    "R": "now from another mod",
+    "RM": "modified and now from another mod",
+}
+
+
+def read_snapshot(mod_folder):
+    # Read the manifest of a preserved playset, packed or not.
+    # Returns its mods by gameRegistryId, and its files by path key.
+    manifest_path = mod_folder / PROVENANCE_FILE
+    archive_path = get_mod_archive(mod_folder)
+    if not manifest_path.exists() and archive_path.exists():
+        with tempfile.TemporaryDirectory() as td:
+            with zipfile.ZipFile(archive_path) as archive:
+                archive.extract(PROVENANCE_FILE, td)
+            return read_snapshot(Path(td))
+
+    db_connection = open_db_connection(manifest_path)
+    sql = "SELECT mod_index, gameRegistryId, displayName, version FROM mods;"
+    mod_rows = db_connection.execute(sql).fetchall()
+    registry_ids = {row["mod_index"]: row["gameRegistryId"] for row in mod_rows}
+    sql = "SELECT path, mod_index, size, mtime_ns, hash FROM files;"
+    files = {
+        path_key(path): SnapshotFile(
+            path, registry_ids[mod_index], size, mtime_ns, digest
+        )
+        for path, mod_index, size, mtime_ns, digest in db_connection.execute(sql)
+    }
+    db_connection.close()
+    return {row["gameRegistryId"]: row for row in mod_rows}, files
+
+
+def stat_planned_file(sources, planned):
+    # Runs on the thread pool.
+    # (size, mtime in ns) of a planned file as it is now, or None if it's gone.
+    try:
+        return stat_mod_file(sources[planned.mod_index], planned.rel_path)
+    except FileNotFoundError:
+        return None
+
+
+def read_live_snapshot(mods, ck3_directory, scan_cache, workers=DEFAULT_COPY_WORKERS):
+    # The files the playset would be preserved with now, like read_snapshot.
+    # Only hashes remembered in the scan cache are known.
+    merge_plan = plan_playset(mods, ck3_directory, scan_cache)
+    mod_hashes = [get_cached_hashes(scan_cache, mod) for mod in mods]
+    # The plan may come from a cached listing, which misses files changed
+    # in place, so every file is checked as it is now
+    sources = open_mod_sources(mods)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            stats = list(
+                executor.map(
+                    lambda planned: stat_planned_file(sources, planned),
+                    merge_plan.files,
+                )
+            )
+    finally:
+        close_mod_sources(sources)
+    files = {}
+    for planned, stat in zip(merge_plan.files, stats):
+        if stat is None:
+            continue
+        known = mod_hashes[planned.mod_index].get(planned.rel_path)
+        files[path_key(planned.rel_path)] = SnapshotFile(
+            planned.rel_path,
+            mods[planned.mod_index]["gameRegistryId"],
+            *stat,
+            known[2] if known and known[:2] == stat else None,
+        )
+    return {mod["gameRegistryId"]: mod for mod in mods}, files
+
+
+def snapshot_files_match(old, new, old_mods, new_mods):
+    # Whether two versions of a file have the same contents,
+    # or None if that can't be told without hashing them.
+    # Files of different sizes never match. A file from the same version
+    # of the same mod, with the same date, is taken to be the same.
+    if old.size != new.size:
+        return False
+    if old.hash and new.hash:
+        return old.hash == new.hash
+    if (
+        old.mod == new.mod
+        and old.mtime_ns == new.mtime_ns
+        and old_mods[old.mod]["version"] == new_mods[new.mod]["version"]
+    ):
+        return True
+    return None
+
+
+def hash_live_files(mods, files, keys, scan_cache, workers=DEFAULT_COPY_WORKERS):
+    # Fill in the hashes of the given files of a live snapshot,
+    # and remember them in the scan cache
+    mod_indexes = {mod["gameRegistryId"]: i for i, mod in enumerate(mods)}
+    mod_hashes = [{} for _ in mods]
+    sources = open_mod_sources(mods)
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                key: executor.submit(
+                    hash_mod_file, sources[mod_indexes[files[key].mod]], files[key].path
+                )
+                for key in keys
+            }
+            for key, future in futures.items():
+                file = files[key] = files[key]._replace(hash=future.result())
+                mod_index = mod_indexes[file.mod]
+                mod_hashes[mod_index][file.path] = (
+                    file.size,
+                    file.mtime_ns,
+                    file.hash,
+                )
+    finally:
+        close_mod_sources(sources)
+    for mod, hashes in zip(mods, mod_hashes):
+        record_cached_hashes(scan_cache, mod, hashes)
+
+
+def hash_snapshot_files(mod_folder, files, keys, workers=DEFAULT_COPY_WORKERS):
+    # Fill in the hashes of the given files of a preserved playset,
+    # packed or not, by reading the preserved files
+    archive = None
+    if not mod_folder.is_dir():
+        archive = zipfile.ZipFile(get_mod_archive(mod_folder))
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                key: executor.submit(
+                    hash_mod_file, archive or mod_folder, files[key].path
+                )
+                for key in keys
+            }
+            for key, future in futures.items():
+                files[key] = files[key]._replace(hash=future.result())
+    finally:
+        if archive is not None:
+            archive.close()
+
+
+def diff_snapshots(old_mods, old_files, new_mods, new_files):
+    # Yields (status, old, new) for every file that differs between
+    # two versions of a playset, in path order, with status a key of
+    # DIFF_STATUSES. Files that can't be compared are taken to be modified.
+    for key in sorted(old_files.keys() | new_files.keys()):
+        old = old_files.get(key)
+        new = new_files.get(key)
+        if old is None:
+            yield "A", None, new
+        elif new is None:
+            yield "D", old, None
+        else:
+            modified = snapshot_files_match(old, new, old_mods, new_mods) is not True
+            status = ("R" if old.mod != new.mod else "") + ("M" if modified else "")
+            if status:
+                yield status, old, new
+
+
+def print_snapshot_diff(old_mods, old_files, new_mods, new_files, list_files=True):
+    # The mods added, removed and updated, then the files that changed,
+    # then how many files changed in each mod
+    for registry_id, mod in old_mods.items():
+        if registry_id not in new_mods:
+            print(f"- [{mod['displayName']}] {mod['version']}")
+    for registry_id, mod in new_mods.items():
+        old_mod = old_mods.get(registry_id)
+        if old_mod is None:
+            print(f"+ [{mod['displayName']}] {mod['version']}")
+        elif old_mod["version"] != mod["version"]:
+            print(f"  [{mod['displayName']}] {old_mod['version']} -> {mod['version']}")
+    print()
+
+    def display_name(file, mods):
+        return mods[file.mod]["displayName"]
+
+    mod_changes = {}
+    for status, old, new in diff_snapshots(old_mods, old_files, new_mods, new_files):
+        if new is None:
+            mods = f"[{display_name(old, old_mods)}]"
+            key = display_name(old, old_mods)
+        elif old is None or old.mod == new.mod:
+            mods = f"[{display_name(new, new_mods)}]"
+            key = display_name(new, new_mods)
+        else:
+            mods = f"[{display_name(old, old_mods)}] -> [{display_name(new, new_mods)}]"
+            key = display_name(new, new_mods)
+        mod_changes.setdefault(key, Counter())[status] += 1
+        if list_files:
+            print(f"{status:<2} {(new or old).path} {mods}")
+    if list_files and mod_changes:
+        print()
+
+    total = Counter()
+    for name in sorted(mod_changes):
+        changes = mod_changes[name]
+        total.update(changes)
+        counts = ", ".join(
+            f"{changes[status]} {label}"
+            for status, label in DIFF_STATUSES.items()
+            if changes[status]
+        )
+        print(f"[{name}]: {counts}")
+    if not total:
+        print("No files changed.")
+        return
+    counts = ", ".join(
+        f"{total[status]} {label}"
+        for status, label in DIFF_STATUSES.items()
+        if total[status]
+    )
+    print(f"All mods: {counts}")
+
+
+def create_playset(db_path, mod_name, mod_folder_name, archive_path=None):
+    # archive_path is set for a merged mod packed into an archive
+    start = time.perf_counter()
+    mod_id = str(uuid.uuid4())  # New random ID
+    mod_file = f"mod/{mod_folder_name}.mod"
+    created = time.time_ns() // 1000000  # Unix time in milliseconds
+    playset_id = str(uuid.uuid4())  # New random ID
+    playset_name = mod_name
+
+    db_connection = open_db_connection(db_path)
+    db_connection.execute(
+        "INSERT INTO mods (id, gameRegistryId, displayName, archivePath, status, source,"
+        " createdDate) VALUES (?, ?, ?, ?, 'ready_to_play', 'local', ?);",
+        (mod_id, mod_file, mod_name, archive_path and str(archive_path), created),
+    )
+    db_connection.execute(
+        "INSERT INTO playsets (id, name, isActive, loadOrder, createdOn, syncState) VALUES"
+        " (?, ?, 0, 'custom', ?, 'NOT_ELIGIBLE');",
+        (playset_id, playset_name, created),
+    )
+    db_connection.execute(
+        "INSERT INTO playsets_mods (playsetId, modId, position) VALUES (?, ?, 0);",
+        (playset_id, mod_id),
+    )
+    # Commit the changes in one transaction
+    db_connection.commit()
+    db_connection.close()
+    log_timing("db_write", start)
+
+
+def main():
+    display_welcome_message()
+
+    # Agreement prompt
+    print()
+    agreement = input(
+        "No support or troubleshooting is provided for preserved playsets."
+        "\nBy using this method, you agree to not seek advice for gameplay or mod-related issues,"
+        "\nbe it on the authors' Discord servers, Steam pages, or elsewhere."
+        "\nYou are not allowed to distribute the preserved playset. All content belong to their respective authors."
+        "\nHave you understood? - y/[n]: "
+    )
+    if agreement.lower() != "y":
+        print()
+        print("Exiting program. Please re-run the program if you agree to the terms.")
+        return
+
+    if (located := locate_game_files()) is None:
+        return
+    ck3_directory, db_path = located
+    mod_directory = ck3_directory / "mod"
+
+    # Select the playset based on the launcher database
+    print()
+    scan_cache = open_scan_cache(ck3_directory)
+    playset = select_playset(db_path, scan_cache)
+    if playset is None:
+        scan_cache.close()
+        return
+
+    # Load the mods from the selected playset
+    mods = get_playset_mods(db_path, playset["id"])
+
+    # Mods that are missing on disk (red error sign in launcher)
+    # have a different status from ready_to_play.
+    if not_found_mods := [m for m in mods if m["status"] != "ready_to_play"]:
+        print()
+        print("ERROR: The launcher cannot find the following mods:")
+        for mod in not_found_mods:
+            mods.remove(mod)
+            print(f"- {mod['displayName']}")
+        print("Unsubscribing, resubscribing, and restarting the launcher might resolve this.")
+        continue_input = input("Ignore these mods and continue? - y/[n]: ")
+        if continue_input.lower() != "y":
+            print("Exiting program.")
+            return
+
+    # Skip mods disabled in playset and inform user
+    if disabled_mods := [m for m in mods if not m["enabled"]]:
+        print()
+        print(
+            "The following mods are disabled in the selected playset"
+            "\nand will NOT be included in the preserved playset:"
+        )
+        for mod in disabled_mods:
+            mods.remove(mod)
+            print(f"- {mod['displayName']}")
+
+    # Prompt for the game version
+    print()
+    game_version = get_game_version(mods)
+
+    # Prompt user for mod/playset name
+    new_mod_name, new_mod_folder, update = get_new_mod_name(
+        playset["name"], mod_directory
+    )
+
+    compare_hashes = False
+    resumed_header = None
+    if (new_mod_folder / JOURNAL_FILE).exists():
+        # Carry on with the settings of the interrupted preserve
+        resumed_header, _ = read_journal(new_mod_folder)
+        compare_hashes = resumed_header["compare_hashes"]
+    elif update:
+        print()
+        hash_input = input(
+            "Files with the same size and modification date are assumed to be up to date."
+            "\nCompare their contents too? This is slower, but catches every change. - y/[n]: "
+        )
+        compare_hashes = hash_input.lower() == "y"
+
+    use_store = False
+    if resumed_header:
+        use_store = resumed_header["use_store"]
+    else:
+        print()
+        store_input = input(
+            "Files can be shared with other playsets preserved this way, through a store"
+            f'\nin the "{STORE_FOLDER}" folder, so that each distinct file takes space only once.'
+            "\nHowever, editing a file of a preserved playset then changes it in all of them."
+            "\nShare identical files? - y/[n]: "
+        )
+        use_store = store_input.lower() == "y"
+
+    pack = False
+    if resumed_header:
+        pack = resumed_header["pack"]
+    elif not update:
+        print()
+        pack_input = input(
+            "The preserved playset can be packed into a single zip archive, which is"
+            "\nquicker to back up, move and scan for viruses, and often takes less space."
+            "\nIt can't be updated in place later, only preserved anew."
+            "\nPack it into an archive? - y/[n]: "
+        )
+        pack = pack_input.lower() == "y"
+
+    # Hard links only work within one volume, so only offer them
+    # when some mod folders are on the same one as the mod directory
+    link_strategy = "reflink"
+    mod_directory_device = mod_directory.stat().st_dev
+    if resumed_header:
+        link_strategy = resumed_header["link_strategy"]
+    elif use_store:
+        # Files are linked from the store instead
+        pass
+    elif any(
+        mod["dirPath"] and os.stat(mod["dirPath"]).st_dev == mod_directory_device
+        for mod in mods
+    ):
+        print()
+        hardlink_input = input(
+            "Some mods are on the same drive as the mod folder. Their files can be"
+            "\nhard-linked instead of copied, which is faster and uses no extra disk space."
+            "\nHowever, if Steam or a mod author then changes one of those files in place,"
+            "\nthe preserved playset will change with it."
+            "\nUse hard links? - y/[n]: "
+        )
+        if hardlink_input.lower() == "y":
+            link_strategy = "hardlink"
+
+    # Plan the whole merge before writing anything,
+    # so that problems are found up front
+    print()
+    print("Scanning mods...")
+    merge_plan = plan_playset(mods, ck3_directory, scan_cache)
+    print_merge_plan(mods, merge_plan, new_mod_folder)
+    required_bytes = estimate_bytes_to_write(
+        mods, merge_plan, new_mod_folder, link_strategy, update, pack
+    )
+    if not check_disk_space(required_bytes, mod_directory):
+        return
+    while shorter_by := path_length_excess(merge_plan, new_mod_folder):
+        if update:
+            print()
+            print(
+                "ERROR: The updated playset would contain paths too long for Windows."
+                "\nPreserve it under a new, shorter name instead."
+            )
+            return
+        new_mod_folder = ask_shorter_folder_name(new_mod_folder, shorter_by)
+        if new_mod_folder is None:
+            return
+
+    # Copy mod folders based on the launcher database
+    print()
+    print("Starting copy operation...")
+    preserve_playset(
+        mods,
+        playset,
+        new_mod_folder,
+        new_mod_name,
+        game_version,
+        merge_plan,
+        link_strategy=link_strategy,
+        update=update,
+        compare_hashes=compare_hashes,
+        use_store=use_store,
+        scan_cache=scan_cache,
+        pack=pack,
+    )
+    scan_cache.close()
+
+    # A resumed preserve may have been creating the mod or updating it
+    if resumed_header:
+        update = resumed_header["update"]
+    archive_path = get_mod_archive(new_mod_folder) if pack else None
+    print()
+    if update:
+        # The launcher already knows this mod
+        print(f"Preserved playset mod {new_mod_name} updated in {new_mod_folder}")
+    else:
+        print(
+            f"Preserved playset mod {new_mod_name} created in"
+            f" {archive_path or new_mod_folder}"
+        )
+
+        # Prompt to create the playset in the launcher's DB
+        print()
+        create_playset_input = input(
+            "Create a new playset in launcher containing only this new mod? - [y]/n: "
+        )
+        if create_playset_input.lower() != "n":
+            create_playset(db_path, new_mod_name, new_mod_folder.name, archive_path)
+            print(f"Playset {new_mod_name} created in launcher")
+
+    print()
+    print("If launcher is open, close and reopen it to see changes.")
+
+
+def load_playset(playset_spec):
+    # Find the launcher database and the enabled, available mods of a playset
+    # for a command. Returns (ck3_directory, db_path, playset, mods),
+    # or None after printing the problem.
+    if (located := locate_game_files()) is None:
+        return None
+    ck3_directory, db_path = located
+
+    if playset_spec is None:
+        scan_cache = open_scan_cache(ck3_directory)
+        playset = select_playset(db_path, scan_cache)
+        scan_cache.close()
+    else:
+        playset = find_playset(db_path, playset_spec)
+        if playset is None:
+            print(f'ERROR: Playset "{playset_spec}" not found.')
+    if playset is None:
+        return None
+
+    mods = []
+    for mod in get_playset_mods(db_path, playset["id"]):
+        if mod["status"] != "ready_to_play":
+            print(f"WARNING: Skipping {mod['displayName']}, which the launcher cannot find.")
+        elif mod["enabled"]:
+            mods.append(mod)
+    return ck3_directory, db_path, playset, mods
+
+
+def conflicts_command(args):
+    if (loaded := load_playset(args.playset)) is None:
+        return 1
+    ck3_directory, _, playset, mods = loaded
+
+    start = time.perf_counter()
+    scan_cache = open_scan_cache(ck3_directory)
+    conflicts = analyze_conflicts(mods, ck3_directory, args.workers, scan_cache)
+    scan_cache.close()
+    print(f"Analyzed {playset['name']} in {time.perf_counter() - start:.1f} s.")
+    print()
+    print_conflict_report(mods, conflicts, args.details)
+    return 0
+
+
+def plan_command(args):
+    if (loaded := load_playset(args.playset)) is None:
+        return 1
+    ck3_directory, _, playset, mods = loaded
+    mod_name = args.name or get_default_mod_name(playset["name"])
+    new_mod_folder = get_mod_folder(mod_name, ck3_directory / "mod")
+    update = is_preserved_playset(new_mod_folder)
+
+    scan_cache = open_scan_cache(ck3_directory)
+    merge_plan = plan_playset(mods, ck3_directory, scan_cache)
+    scan_cache.close()
+    print_merge_plan(
+        mods, merge_plan, new_mod_folder, per_mod=True, list_files=args.list_files
+    )
+    if update:
+        print("The folder holds a preserved playset, which would be updated.")
+
+    longest_path = longest_destination_path(merge_plan, new_mod_folder)
+    print(f"Longest path: {longest_path} characters (Windows limit: {MAX_PATH - 1})")
+    link_strategy = "hardlink" if args.hardlink else "reflink"
+    required_bytes = estimate_bytes_to_write(
+        mods, merge_plan, new_mod_folder, link_strategy, update
+    )
+    if not check_disk_space(required_bytes, ck3_directory / "mod"):
+        return 1
+    if shorter_by := path_length_excess(merge_plan, new_mod_folder):
+        print(
+            "ERROR: Paths too long for Windows."
+            f" Use a name at least {shorter_by} characters shorter."
+        )
+        return 1
+    return 0
+
+
+def preserve_command(args):
+    # Settings come from the command line, then the config file, then defaults
+    config = {}
+    if args.config:
+        with open(args.config, encoding="utf-8") as f:
+            config = json.load(f)
+
+    def option(name, default=None):
+        value = getattr(args, name)
+        return config.get(name, default) if value is None else value
+
+    if not option("agree", False):
+        print(
+            "ERROR: No support or troubleshooting is provided for preserved playsets,"
+            "\nand you are not allowed to distribute them."
+            "\nPass --agree to confirm that you have understood."
+        )
+        return 1
+    playset_specs = args.playsets or config.get("playsets", [])
+    if not playset_specs:
+        print("ERROR: No playsets given.")
+        return 1
+
+    name_template = option("name", DEFAULT_MOD_NAME_TEMPLATE)
+    try:
+        get_default_mod_name("", name_template)
+    except (KeyError, IndexError, AttributeError, ValueError):
+        print(
+            f'ERROR: "{name_template}" is not a valid name template.'
+            " It may use {playset}, {date} and {game_version}."
+        )
+        return 1
+    game_version_option = option("game_version")
+    if game_version_option and (problem := check_game_version(game_version_option)):
+        print(f"ERROR: {problem}")
+        return 1
+    if option("zip", False) and option("update", False):
+        # Packed playsets can't be updated in place, only preserved anew
+        print("ERROR: --zip can't be combined with --update.")
+        return 1
+
+    if (located := locate_game_files()) is None:
+        return 1
+    ck3_directory, db_path = located
+    mod_directory = ck3_directory / "mod"
+
+    found = find_playsets_mods(db_path, playset_specs)
+    if None in found:
+        for playset_spec, playset_mods in zip(playset_specs, found):
+            if playset_mods is None:
+                print(f'ERROR: Playset "{playset_spec}" not found.')
+        return 1
+
+    staged_before = option("staged_before")
+    staged_index = None
+    if staged_before is not None:
+        try:
+            staged_before = datetime.fromisoformat(staged_before).timestamp()
+        except ValueError:
+            print(f'ERROR: "{staged_before}" is not a date like 2024-05-06 18:00.')
+            return 1
+    if option("staged", False) or staged_before is not None:
+        staged_index = open_staged_index(mod_directory)
+
+    jobs = []
+    for playset, all_mods in found:
+        mods = []
+        for mod in all_mods:
+            if mod["status"] != "ready_to_play":
+                print(
+                    f"WARNING: Skipping {mod['displayName']} in {playset['name']},"
+                    " which the launcher cannot find."
+                )
+            elif mod["enabled"]:
+                mods.append(mod)
+        if staged_index is not None:
+            mods = use_staged_versions(staged_index, mods, mod_directory, staged_before)
+        game_version = game_version_option or default_game_version(mods)
+        new_mod_name = get_default_mod_name(
+            playset["name"], name_template, game_version
+        )
+        if "\\" in new_mod_name or "\t" in new_mod_name or len(new_mod_name) < 3:
+            print(f'ERROR: "{new_mod_name}" is not a valid preserved playset name.')
+            return 1
+        new_mod_folder = get_mod_folder(new_mod_name, mod_directory)
+        if any(job[2] == new_mod_folder for job in jobs):
+            print(
+                "ERROR: Several playsets would be preserved as"
+                f' "{new_mod_folder.name}".'
+                " Use a name template that tells them apart."
+            )
+            return 1
+        jobs.append((playset, mods, new_mod_folder, new_mod_name, game_version))
+
+    # Each mod is only scanned once, through the scan cache,
+    # however many of the playsets use it
+    scan_cache = open_scan_cache(ck3_directory)
+
+    failures = 0
+    try:
+        for playset, mods, new_mod_folder, new_mod_name, game_version in jobs:
+            print()
+            print(f"Preserving {playset['name']} as {new_mod_name}")
+            dotmod = new_mod_folder.with_name(f"{new_mod_folder.name}.mod")
+            resumed_header = None
+            if (new_mod_folder / JOURNAL_FILE).exists():
+                resumed_header, _ = read_journal(new_mod_folder)
+            link_strategy = "hardlink" if option("hardlink", False) else "reflink"
+            compare_hashes = option("compare_hashes", False)
+            use_store = option("share_files", False)
+            pack = option("zip", False)
+            if resumed_header and resumed_header["playset_id"] == playset["id"]:
+                # Finished the way it was started, whatever the options now
+                print("Resuming the interrupted preserve.")
+                update = True
+                creates_mod = not resumed_header["update"]
+                link_strategy = resumed_header["link_strategy"]
+                compare_hashes = resumed_header["compare_hashes"]
+                use_store = resumed_header["use_store"]
+                pack = resumed_header["pack"]
+            elif (
+                not resumed_header
+                and is_preserved_playset(new_mod_folder)
+                and option("update", False)
+            ):
+                update = True
+                creates_mod = False
+            elif (
+                new_mod_folder.exists()
+                or dotmod.exists()
+                or get_mod_archive(new_mod_folder).exists()
+            ):
+                print(
+                    f'ERROR: "{new_mod_folder.name}" already exists.'
+                    " Pass --update to update a preserved playset."
+                )
+                failures += 1
+                continue
+            else:
+                update = False
+                creates_mod = True
+
+            merge_plan = plan_playset(mods, ck3_directory, scan_cache)
+            print_merge_plan(mods, merge_plan, new_mod_folder)
+            required_bytes = estimate_bytes_to_write(
+                mods, merge_plan, new_mod_folder, link_strategy, update, pack
+            )
+            if not check_disk_space(required_bytes, mod_directory):
+                failures += 1
+                continue
+            if shorter_by := path_length_excess(merge_plan, new_mod_folder):
+                print(
+                    "ERROR: Paths too long for Windows."
+                    f" Use a name at least {shorter_by} characters shorter."
+                )
+                failures += 1
+                continue
+
+            preserve_playset(
+                mods,
+                playset,
+                new_mod_folder,
+                new_mod_name,
+                game_version,
+                merge_plan,
+                link_strategy=link_strategy,
+                update=update,
+                compare_hashes=compare_hashes,
+                workers=option("workers", DEFAULT_COPY_WORKERS),
+                use_store=use_store,
+                scan_cache=scan_cache,
+                pack=pack,
+            )
+            archive_path = get_mod_archive(new_mod_folder) if pack else None
+            print(
+                f"Preserved playset mod {new_mod_name} written to"
+                f" {archive_path or new_mod_folder}"
+            )
+            if creates_mod and option("create_playset", False):
+                create_playset(db_path, new_mod_name, new_mod_folder.name, archive_path)
+                print(f"Playset {new_mod_name} created in launcher")
+    finally:
+        scan_cache.close()
+
+    if failures:
+        print()
+        print(f"ERROR: {failures} of {len(jobs)} playsets could not be preserved.")
+        return 1
+    return 0
+
+
+def resume_command(args):
+    new_mod_folder = resolve_mod_folder(args.mod_folder)
+    if not (new_mod_folder / JOURNAL_FILE).exists():
+        print(f'ERROR: No interrupted preserve found in "{new_mod_folder}".')
+        return 1
+    header, _ = read_journal(new_mod_folder)
+    if (loaded := load_playset(header["playset_id"])) is None:
+        return 1
+    ck3_directory, db_path, playset, mods = loaded
+
+    print("Scanning mods...")
+    scan_cache = open_scan_cache(ck3_directory)
+    merge_plan = plan_playset(mods, ck3_directory, scan_cache)
+    print_merge_plan(mods, merge_plan, new_mod_folder)
+    required_bytes = estimate_bytes_to_write(
+        mods, merge_plan, new_mod_folder, header["link_strategy"], True, header["pack"]
+    )
+    if not check_disk_space(required_bytes, new_mod_folder.parent):
+        return 1
+    if shorter_by := path_length_excess(merge_plan, new_mod_folder):
+        print(
+            "ERROR: Paths too long for Windows."
+            " The playset has changed since the preserve was interrupted;"
+            f" preserve it under a name at least {shorter_by} characters shorter."
+        )
+        return 1
+
+    print()
+    print("Resuming copy operation...")
+    preserve_playset(
+        mods,
+        playset,
+        new_mod_folder,
+        header["name"],
+        header["game_version"],
+        merge_plan,
+        link_strategy=header["link_strategy"],
+        update=True,
+        compare_hashes=header["compare_hashes"],
+        workers=args.workers,
+        use_store=header["use_store"],
+        scan_cache=scan_cache,
+        pack=header["pack"],
+    )
+    scan_cache.close()
+    archive_path = get_mod_archive(new_mod_folder) if header["pack"] else None
+    print()
+    print(
+        f"Preserved playset mod {header['name']} completed in"
+        f" {archive_path or new_mod_folder}"
+    )
+    if args.create_playset and not header["update"]:
+        create_playset(db_path, header["name"], new_mod_folder.name, archive_path)
+        print(f"Playset {header['name']} created in launcher")
+    return 0
+
+
+# Folder in the mod directory where the watch command keeps the versions
+# of mods it has seen, as hard links to the content store,
+# so they can still be preserved after Steam updates the mods
+STAGED_FOLDER = "CK3_PP_staged"
+STAGED_INDEX_FILE = "staged.sqlite"
+# Copy of the launcher's .mod file kept at the top of each staged version,
+# for its replace_path lines. Top-level files are never merged.
+STAGED_DESCRIPTOR_FILE = "CK3_PP_descriptor.mod"
+STAGED_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS staged (
+        staged_id INTEGER PRIMARY KEY,
+        gameRegistryId TEXT NOT NULL,
+        displayName TEXT,
+        version TEXT,
+        location TEXT NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        folder TEXT NOT NULL,
+        staged_at REAL NOT NULL,
+        tags TEXT,
+        requiredVersion TEXT
+    );
+    CREATE TABLE IF NOT EXISTS staged_files (
+        staged_id INTEGER NOT NULL,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        hash TEXT NOT NULL,
+        PRIMARY KEY (staged_id, path)
+    ) WITHOUT ROWID;
+"""
+
+
+def open_staged_index(mod_directory):
+    staged_root = mod_directory / STAGED_FOLDER
+    staged_root.mkdir(exist_ok=True)
+    staged_index = open_db_connection(staged_root / STAGED_INDEX_FILE)
+    staged_index.execute("PRAGMA journal_mode = WAL;")
+    staged_index.executescript(STAGED_SCHEMA)
+    # Versions staged before the launcher's details were kept have none,
+    # and are preserved with the mod's current ones
+    columns = {row["name"] for row in staged_index.execute("PRAGMA table_info(staged);")}
+    for column in ("tags", "requiredVersion"):
+        if column not in columns:
+            staged_index.execute(f"ALTER TABLE staged ADD COLUMN {column} TEXT;")
+    return staged_index
+
+
+def find_staged_version(staged_index, game_registry_id, before=None):
+    # The newest staged version of a mod, staged before the given
+    # time.time() if any, or None
+    sql = (
+        "SELECT * FROM staged WHERE gameRegistryId = ? AND staged_at <= ?"
+        " ORDER BY staged_at DESC LIMIT 1;"
+    )
+    before = time.time() if before is None else before
+    return staged_index.execute(sql, (game_registry_id, before)).fetchone()
+
+
+def make_throttle(bytes_per_second):
+    # Returns a function to call with the bytes read after reading them,
+    # which sleeps as long as needed to keep to the given average rate
+    start = time.perf_counter()
+    total_bytes = 0
+
+    def throttle(num_bytes):
+        nonlocal total_bytes
+        total_bytes += num_bytes
+        ahead = total_bytes / bytes_per_second - (time.perf_counter() - start)
+        if ahead > 0:
+            time.sleep(ahead)
+
+    return throttle
+
+
+def stage_mod(staged_index, mod, mod_directory, throttle, scan_cache=None):
+    # Keep a copy of the mod's current version, unless it's staged already:
+    # the same version, with the same files, sizes and dates as last time.
+    # Files are added to the content store and hard-linked from there,
+    # so a file is only stored once however many versions include it.
+    # Files unchanged since the last staged version aren't read again.
+    # With scan_cache, the new version's listing and hashes are cached,
+    # so the playset list knows its size and preserving needn't scan it.
+    # Returns the number of files and of bytes added to the store,
+    # or None if the version was staged already.
+    location = mod["archivePath"] or mod["dirPath"]
+    mtime_ns = os.stat(location).st_mtime_ns
+    latest = find_staged_version(staged_index, mod["gameRegistryId"])
+    previous = {}
+    if latest:
+        sql = "SELECT path, size, mtime_ns, hash FROM staged_files WHERE staged_id = ?;"
+        for row in staged_index.execute(sql, (latest["staged_id"],)):
+            previous[row["path"]] = (row["size"], row["mtime_ns"], row["hash"])
+
+    store_folder = mod_directory / STORE_FOLDER
+    folder_name = uuid.uuid4().hex
+    staged_folder = mod_directory / STAGED_FOLDER / folder_name
+    files = []
+    added_files = 0
+    added_bytes = 0
+    folder_times = []
+    (source,) = open_mod_sources([mod])
+    try:
+        # Files added, removed or rewritten in subfolders don't change
+        # the date of the mod's own folder, so the listing is compared
+        listing = scan_mod_files(source, folder_times)
+        if (
+            latest
+            and (latest["version"], latest["location"]) == (mod["version"], location)
+            and len(listing) == len(previous)
+            and all(
+                previous.get(rel_path, ())[:2] == (size, file_mtime_ns)
+                for rel_path, size, file_mtime_ns in listing
+            )
+        ):
+            return None
+        for rel_path, size, file_mtime_ns in listing:
+            old = previous.get(rel_path)
+            if old and old[:2] == (size, file_mtime_ns):
+                digest = old[2]
+            else:
+                digest = hash_mod_file(source, rel_path)
+                throttle(size)
+            store_object = store_object_path(store_folder, digest)
+            if add_store_object(source, rel_path, store_object):
+                throttle(size)
+                added_files += 1
+                added_bytes += size
+            dst = staged_folder / rel_path
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            os.link(store_object, dst)
+            files.append((rel_path, size, file_mtime_ns, digest))
+    finally:
+        close_mod_sources([source])
+    staged_folder.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(
+        mod_directory.parent / mod["gameRegistryId"],
+        staged_folder / STAGED_DESCRIPTOR_FILE,
+    )
+
+    # The version only counts as staged once all its files are
+    with staged_index:
+        staged_id = staged_index.execute(
+            "INSERT INTO staged (gameRegistryId, displayName, version, location,"
+            " mtime_ns, folder, staged_at, tags, requiredVersion)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);",
+            (
+                mod["gameRegistryId"],
+                mod["displayName"],
+                mod["version"],
+                location,
+                mtime_ns,
+                folder_name,
+                time.time(),
+                mod["tags"],
+                mod["requiredVersion"],
+            ),
+        ).lastrowid
+        staged_index.executemany(
+            "INSERT INTO staged_files VALUES (?, ?, ?, ?, ?);",
+            ((staged_id, *file) for file in files),
+        )
+    if scan_cache is not None:
+        record_cached_listing(
+            scan_cache, mod, location, mtime_ns, listing, folder_times
+        )
+        hashes = {path: (size, mtime, digest) for path, size, mtime, digest in files}
+        record_cached_hashes(scan_cache, mod, hashes)
+    return added_files, added_bytes
+
+
+def prune_staged_versions(staged_index, mod_directory, keep):
+    # Delete all but the newest staged versions of each mod, and
+    # folders of versions whose staging was interrupted.
+    # The store's objects they used are freed by collect_store_garbage.
+    staged_root = mod_directory / STAGED_FOLDER
+    sql = "SELECT staged_id, gameRegistryId FROM staged ORDER BY staged_at DESC;"
+    kept = Counter()
+    with staged_index:
+        for row in staged_index.execute(sql).fetchall():
+            kept[row["gameRegistryId"]] += 1
+            if kept[row["gameRegistryId"]] > keep:
+                staged_index.execute(
+                    "DELETE FROM staged_files WHERE staged_id = ?;", (row["staged_id"],)
+                )
+                staged_index.execute(
+                    "DELETE FROM staged WHERE staged_id = ?;", (row["staged_id"],)
+                )
+    sql = "SELECT folder FROM staged;"
+    folders = {row["folder"] for row in staged_index.execute(sql)}
+    for entry in os.scandir(staged_root):
+        if entry.is_dir() and entry.name not in folders:
+            shutil.rmtree(entry.path)
+
+
+def use_staged_versions(staged_index, mods, mod_directory, before=None):
+    # Replace each mod by its newest version staged before the given
+    # time.time(), to be preserved like a mod folder.
+    # Mods without one are kept as they are.
+    staged_mods = []
+    for mod in mods:
+        staged = find_staged_version(staged_index, mod["gameRegistryId"], before)
+        if staged is None:
+            print(
+                f"WARNING: No staged version of {mod['displayName']},"
+                " using the current one."
+            )
+            staged_mods.append(mod)
+            continue
+        staged_folder = mod_directory / STAGED_FOLDER / staged["folder"]
+        staged_mod = dict(
+            mod,
+            version=staged["version"],
+            archivePath=None,
+            dirPath=str(staged_folder),
+        )
+        # The launcher's details as they were when the version was staged
+        if staged["tags"] is not None:
+            staged_mod["tags"] = staged["tags"]
+            staged_mod["requiredVersion"] = staged["requiredVersion"]
+        if (staged_folder / STAGED_DESCRIPTOR_FILE).exists():
+            staged_mod["descriptorPath"] = str(staged_folder / STAGED_DESCRIPTOR_FILE)
+        staged_mods.append(staged_mod)
+    return staged_mods
+
+
+def lower_process_priority():
+    # Let the game and everything else go first, for the CPU and the disk
+    if os.name == "nt":
+        import ctypes
+
+        # Background mode lowers I/O and memory priority along with the CPU's
+        PROCESS_MODE_BACKGROUND_BEGIN = 0x00100000
+        kernel32 = ctypes.windll.kernel32
+        kernel32.SetPriorityClass(
+            kernel32.GetCurrentProcess(), PROCESS_MODE_BACKGROUND_BEGIN
+        )
+    else:
+        os.nice(10)
+
+
+def collect_store_garbage(mod_directory, dry_run=False):
+    # Delete the store's objects that no merged mod or staged version
+    # of a mod links to any more.
+    # The filesystem counts the links, so an object only linked from the
+    # store itself is garbage. Merged mods never depend on the store's own
+    # link, so this can't change them.
+    # Returns the number of objects deleted and their size.
+    deleted_files = 0
+    deleted_bytes = 0
+    for root, dirs, files in os.walk(mod_directory / STORE_FOLDER, topdown=False):
+        for name in files:
+            # Partial files left by an interrupted copy are never linked
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            if stat.st_nlink == 1:
+                deleted_bytes += stat.st_size
+                deleted_files += 1
+                if not dry_run:
+                    os.remove(path)
+        if not dry_run and not os.listdir(root):
+            os.rmdir(root)
+    return deleted_files, deleted_bytes
+
+
+def gc_command(args):
+    if (located := locate_game_files(database=False)) is None:
+        return 1
+    ck3_directory, _ = located
+    deleted_files, deleted_bytes = collect_store_garbage(
+        ck3_directory / "mod", args.dry_run
+    )
+    action = "Would delete" if args.dry_run else "Deleted"
+    print(
+        f"{action} {deleted_files} files ({format_size(deleted_bytes)})"
+        " that no preserved playset uses any more."
+    )
+    return 0
+
+
+def watch_command(args):
+    if (located := locate_game_files()) is None:
+        return 1
+    ck3_directory, db_path = located
+    mod_directory = ck3_directory / "mod"
+
+    lower_process_priority()
+    staged_index = open_staged_index(mod_directory)
+    scan_cache = open_scan_cache(ck3_directory)
+    prune_staged_versions(staged_index, mod_directory, args.keep)
+    throttle = make_throttle(args.max_rate * 1024 * 1024)
+    print(f"Watching for mod updates every {args.interval} s. Press Ctrl+C to stop.")
+    try:
+        while True:
+            # The launcher's list of playsets and mods may change between polls
+            playset_specs = args.playsets
+            if not playset_specs:
+                db_connection = open_db_connection(db_path)
+                playset_specs = [row["id"] for row in read_playsets(db_connection)]
+                db_connection.close()
+            watched = {}
+            for found in find_playsets_mods(db_path, playset_specs):
+                if found is None:
+                    continue
+                for mod in found[1]:
+                    # Mods being downloaded or updated are left until they're
+                    # done. Preserved playsets created without a folder have
+                    # nothing to stage.
+                    if (
+                        mod["status"] == "ready_to_play"
+                        and mod["enabled"]
+                        and (mod["archivePath"] or mod["dirPath"])
+                    ):
+                        watched[mod["gameRegistryId"]] = mod
+
+            staged_any = False
+            for mod in watched.values():
+                start = time.perf_counter()
+                try:
+                    staged = stage_mod(
+                        staged_index, mod, mod_directory, throttle, scan_cache
+                    )
+                except (OSError, zipfile.BadZipFile) as e:
+                    # Steam may be changing the mod right now. Try again next time.
+                    print(f"WARNING: Couldn't stage {mod['displayName']}: {e}")
+                    continue
+                if staged is None:
+                    continue
+                staged_any = True
+                added_files, added_bytes = staged
+                print(
+                    f"{datetime.now():%Y-%m-%d %H:%M} Staged {mod['displayName']}"
+                    f" {mod['version']}: {added_files} new files"
+                    f" ({format_size(added_bytes)})"
+                )
+                log_timing("stage", start, mod=mod["gameRegistryId"], bytes=added_bytes)
+            if staged_any:
+                prune_staged_versions(staged_index, mod_directory, args.keep)
+            if args.once:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        print("Stopped watching.")
+    finally:
+        staged_index.close()
+        scan_cache.close()
+    return 0
+
+
+def verify_command(args):
+    mod_folder = resolve_mod_folder(args.mod_folder)
+    archive_path = get_mod_archive(mod_folder)
+    if not mod_folder.is_dir() and archive_path.exists():
+        # Packed playsets can only be checked against the archive's checksums
+        print(f"Checking {archive_path.name}...")
+        with zipfile.ZipFile(archive_path) as archive:
+            bad_member = archive.testzip()
+        if bad_member is not None:
+            print(f"ERROR: {bad_member} is corrupted. Preserve the playset anew.")
+            return 1
+        print("No problems found.")
+        return 0
+    if not (mod_folder / PROVENANCE_FILE).exists():
+        print(
+            f"ERROR: {mod_folder / PROVENANCE_FILE} not found."
+            " Update the preserved playset to record one."
+        )
+        return 1
+
+    start = time.perf_counter()
+    ck3_directory = locate_ck3_directory()
+    db_path = ck3_directory and locate_database(ck3_directory)
+    unhashed = None
+    if db_path is not None:
+        unhashed = fill_missing_hashes(mod_folder, db_path, args.workers)
+    missing, corrupted, extra = verify_mod_folder(mod_folder, args.workers)
+    log_timing("verify", start)
+    if unhashed:
+        print(
+            f"Files only checked by size, as their mods changed since: {unhashed}"
+        )
+    for label, paths in (
+        ("Missing", [row["path"] for row in missing]),
+        ("Corrupted", [row["path"] for row in corrupted]),
+        ("Not part of the playset", extra),
+    ):
+        if paths:
+            print(f"{label}:")
+            for path in sorted(paths):
+                print(f"- {path}")
+    if not (missing or corrupted or extra):
+        print("No problems found.")
+        return 0
+    if not args.repair:
+        print("Run again with --repair to fix these files.")
+        return 1
+
+    if db_path is None:
+        print("ERROR: Launcher database not found, so the mods can't be read.")
+        return 1
+    unrepaired = repair_mod_folder(mod_folder, missing + corrupted, extra, db_path)
+    if unrepaired:
+        print(
+            f"ERROR: Files left unrepaired: {unrepaired}."
+            " Preserve the playset anew once its mods are available."
+        )
+        return 1
+    print("All problems repaired.")
+    return 0
+
+
+def diff_command(args):
+    if args.other is not None and args.playset is not None:
+        print("ERROR: Give either a second preserved playset or --playset, not both.")
+        return 1
+    snapshots = []
+    for name in (args.snapshot, args.other):
+        if name is None:
+            continue
+        mod_folder = resolve_mod_folder(name)
+        if not (mod_folder / PROVENANCE_FILE).exists() and not (
+            get_mod_archive(mod_folder).exists()
+        ):
+            print(
+                f"ERROR: {mod_folder / PROVENANCE_FILE} not found."
+                " Update the preserved playset to record one."
+            )
+            return 1
+        snapshots.append((mod_folder, *read_snapshot(mod_folder)))
+
+    start = time.perf_counter()
+    scan_cache = None
+    if args.other is None:
+        # Compare with the playset as it is now
+        if (loaded := load_playset(args.playset)) is None:
+            return 1
+        ck3_directory, _, _, mods = loaded
+        scan_cache = open_scan_cache(ck3_directory)
+        snapshots.append(
+            (
+                None,
+                *read_live_snapshot(mods, ck3_directory, scan_cache, args.workers),
+            )
+        )
+    (old_folder, old_mods, old_files), (new_folder, new_mods, new_files) = snapshots
+    # Only files that may have changed without changing size are read,
+    # on the side whose hash isn't known
+    unknown = [
+        key
+        for key in old_files.keys() & new_files.keys()
+        if snapshot_files_match(old_files[key], new_files[key], old_mods, new_mods)
+        is None
+    ]
+    unknown_old = [key for key in unknown if not old_files[key].hash]
+    hash_snapshot_files(old_folder, old_files, unknown_old, args.workers)
+    unknown_new = [key for key in unknown if not new_files[key].hash]
+    if scan_cache is None:
+        hash_snapshot_files(new_folder, new_files, unknown_new, args.workers)
+    else:
+        hash_live_files(mods, new_files, unknown_new, scan_cache, args.workers)
+        scan_cache.close()
+    print_snapshot_diff(
+        old_mods, old_files, new_mods, new_files, list_files=not args.summary
+    )
+    log_timing("diff", start, files=len(old_files.keys() | new_files.keys()))
+    return 0
+
+
+def lookup_command(args):
+    return lookup_files(resolve_mod_folder(args.mod_folder), args.files)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Crusader Kings 3 Playset Preserver."
+        " Run without a command to be guided through preserving a playset."
+    )
+    parser.add_argument(
+        "--timing-log",
+        help="append the time spent in each phase of the work to this file,"
+        " as JSON lines",
+    )
+    subparsers = parser.add_subparsers(dest="command", metavar="command")
+
+    lookup_parser = subparsers.add_parser(
+        "lookup", help="show which mod provides files of a preserved playset"
+    )
+    lookup_parser.add_argument(
+        "mod_folder", help="preserved playset folder, or its name in the mod directory"
+    )
+    lookup_parser.add_argument(
+        "files", nargs="+", help="file paths relative to the preserved playset folder"
+    )
+    lookup_parser.set_defaults(func=lookup_command)
+
+    plan_parser = subparsers.add_parser(
+        "plan",
+        help="show what preserving a playset would copy, and check that it fits,"
+        " without writing anything",
+    )
+    plan_parser.add_argument(
+        "playset",
+        nargs="?",
+        help="playset name or number in the launcher's list (prompted if omitted)",
+    )
+    plan_parser.add_argument(
+        "--name", help="preserved playset name (default: playset name and date)"
+    )
+    plan_parser.add_argument(
+        "--hardlink",
+        action="store_true",
+        help="count files that could be hard-linked as taking no space",
+    )
+    plan_parser.add_argument(
+        "--list-files", action="store_true", help="list every file to be copied"
+    )
+    plan_parser.set_defaults(func=plan_command)
+
+    conflicts_parser = subparsers.add_parser(
+        "conflicts",
+        help="report which mods of a playset override each other's files,"
+        " without copying anything",
+    )
+    conflicts_parser.add_argument(
+        "playset",
+        nargs="?",
+        help="playset name or number in the launcher's list (prompted if omitted)",
+    )
+    conflicts_parser.add_argument(
+        "--details", action="store_true", help="list every file provided by several mods"
+    )
+    conflicts_parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_COPY_WORKERS,
+        help="files to compare at once (default: %(default)s)",
+    )
+    conflicts_parser.set_defaults(func=conflicts_command)
+
+    preserve_parser = subparsers.add_parser(
+        "preserve",
+        help="preserve one or more playsets without prompting,"
+        " for use in scripts",
+    )
+    preserve_parser.add_argument(
+        "playsets",
+        nargs="*",
+        help="playset names, IDs or numbers in the launcher's list",
+    )
+    preserve_parser.add_argument(
+        "--config",
+        help="JSON file with any of these options, named with underscores,"
+        ' and "playsets"; command-line options take precedence',
+    )
+    preserve_parser.add_argument(
+        "--agree",
+        action="store_true",
+        default=None,
+        help="confirm that you seek no support for preserved playsets"
+        " and don't distribute them",
+    )
+    preserve_parser.add_argument(
+        "--game-version",
+        help="game version the playsets are for"
+        " (default: the highest one their mods require)",
+    )
+    preserve_parser.add_argument(
+        "--name",
+        help="preserved playset name template, using {playset}, {date}"
+        f" and {{game_version}} (default: {DEFAULT_MOD_NAME_TEMPLATE})",
+    )
+    preserve_parser.add_argument(
+        "--update",
+        action="store_true",
+        default=None,
+        help="update preserved playsets that already exist",
+    )
+    preserve_parser.add_argument(
+        "--compare-hashes",
+        action="store_true",
+        default=None,
+        help="when updating, compare file contents too",
+    )
+    preserve_parser.add_argument(
+        "--hardlink",
+        action="store_true",
+        default=None,
+        help="hard-link files from mods on the same drive instead of copying them",
+    )
+    preserve_parser.add_argument(
+        "--share-files",
+        action="store_true",
+        default=None,
+        help="share identical files with other preserved playsets"
+        f" through {STORE_FOLDER}",
+    )
+    preserve_parser.add_argument(
+        "--staged",
+        action="store_true",
+        default=None,
+        help="preserve the versions of the mods staged by the watch command",
+    )
+    preserve_parser.add_argument(
+        "--staged-before",
+        metavar="DATE",
+        help="preserve the newest versions of the mods staged before this date,"
+        " like 2024-05-06 or 2024-05-06T18:00 (implies --staged)",
+    )
+    preserve_parser.add_argument(
+        "--zip",
+        action="store_true",
+        default=None,
+        help="pack each new preserved playset into a single zip archive",
+    )
+    preserve_parser.add_argument(
+        "--create-playset",
+        action="store_true",
+        default=None,
+        help="create a launcher playset containing only each new preserved playset",
+    )
+    preserve_parser.add_argument(
+        "--workers",
+        type=int,
+        help=f"files to copy at once (default: {DEFAULT_COPY_WORKERS})",
+    )
+    preserve_parser.set_defaults(func=preserve_command)
+
+    resume_parser = subparsers.add_parser(
+        "resume", help="finish preserving a playset after an interruption"
+    )
+    resume_parser.add_argument(
+        "mod_folder", help="preserved playset folder, or its name in the mod directory"
+    )
+    resume_parser.add_argument(
+        "--create-playset",
+        action="store_true",
+        help="create a launcher playset containing only the preserved playset,"
+        " unless the interrupted preserve was an update",
+    )
+    resume_parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_COPY_WORKERS,
+        help="files to copy at once (default: %(default)s)",
+    )
+    resume_parser.set_defaults(func=resume_command)
+
+    diff_parser = subparsers.add_parser(
+        "diff",
+        help="show which files changed between a preserved playset"
+        " and another one, or the playset as it is now",
+    )
+    diff_parser.add_argument(
+        "snapshot", help="preserved playset folder, or its name in the mod directory"
+    )
+    diff_parser.add_argument(
+        "other",
+        nargs="?",
+        help="newer preserved playset to compare with"
+        " (default: the playset in the launcher)",
+    )
+    diff_parser.add_argument(
+        "--playset",
+        help="playset name or number in the launcher's list to compare with"
+        " (prompted if needed)",
+    )
+    diff_parser.add_argument(
+        "--summary", action="store_true", help="only count the changed files per mod"
+    )
+    diff_parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_COPY_WORKERS,
+        help="files to hash at once (default: %(default)s)",
+    )
+    diff_parser.set_defaults(func=diff_command)
+
+    verify_parser = subparsers.add_parser(
+        "verify",
+        help="check that the files of a preserved playset are intact",
+    )
+    verify_parser.add_argument(
+        "mod_folder", help="preserved playset folder, or its name in the mod directory"
+    )
+    verify_parser.add_argument(
+        "--repair",
+        action="store_true",
+        help="copy missing and corrupted files again from their mods,"
+        " and delete files that aren't part of the playset",
+    )
+    verify_parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_COPY_WORKERS,
+        help="files to check at once (default: %(default)s)",
+    )
+    verify_parser.set_defaults(func=verify_command)
+
+    watch_parser = subparsers.add_parser(
+        "watch",
+        help="keep running in the background, staging each new version of the mods"
+        " of playsets so they can still be preserved after Steam updates them",
+    )
+    watch_parser.add_argument(
+        "playsets",
+        nargs="*",
+        help="playset names or numbers in the launcher's list (default: all)",
+    )
+    watch_parser.add_argument(
+        "--interval",
+        type=int,
+        default=600,
+        help="seconds between checks for updated mods (default: %(default)s)",
+    )
+    watch_parser.add_argument(
+        "--max-rate",
+        type=float,
+        default=20,
+        help="MB per second to read at most (default: %(default)s)",
+    )
+    watch_parser.add_argument(
+        "--keep",
+        type=int,
+        default=2,
+        help="staged versions to keep of each mod (default: %(default)s)",
+    )
+    watch_parser.add_argument(
+        "--once", action="store_true", help="check once and exit, e.g. from a scheduler"
+    )
+    watch_parser.set_defaults(func=watch_command)
+
+    gc_parser = subparsers.add_parser(
+        "gc",
+        help="free the space of shared files that no preserved playset uses any more",
+    )
+    gc_parser.add_argument(
+        "--dry-run", action="store_true", help="only report what would be deleted"
+    )
+    gc_parser.set_defaults(func=gc_command)
+
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
+    args = parse_args()
+    if args.timing_log:
+        timing_log = open(args.timing_log, "a", encoding="utf-8", buffering=1)
+    if args.command:
+        # Commands are meant to be run from a terminal or script,
+        # so they don't wait for Enter before exiting
+        sys.exit(args.func(args))
     try:
         main()
     except:  # noqa: E722
@@ -0,0 +1,362 @@
+import argparse
+import contextlib
+import gc
+import io
+import json
+import math
+import os
+from pathlib import Path
+import platform
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+import CK3_PP
+
+# Bumped whenever results stop being comparable with earlier ones
+RESULTS_FORMAT = 1
+
+
+def create_launcher(root, args):
+    # Lay out a fake game directory, Steam library and launcher database
+    # for one playset. The layout only depends on the arguments and the seed,
+    # so runs with the same arguments measure the same work.
+    rng = random.Random(args.seed)
+    ck3_directory = root / "Crusader Kings III"
+    mod_directory = ck3_directory / "mod"
+    mod_directory.mkdir(parents=True)
+    workshop = root / "workshop"
+    workshop.mkdir()
+
+    db_connection = sqlite3.connect(ck3_directory / "launcher-v2.sqlite")
+    db_connection.executescript(
+        """
+        CREATE TABLE mods (
+            id TEXT PRIMARY KEY, gameRegistryId TEXT, displayName TEXT,
+            version TEXT, tags TEXT, requiredVersion TEXT, dirPath TEXT,
+            archivePath TEXT, status TEXT, source TEXT, createdDate INTEGER
+        );
+        CREATE TABLE playsets (
+            id TEXT PRIMARY KEY, name TEXT, isActive INTEGER, loadOrder TEXT,
+            createdOn INTEGER, syncState TEXT
+        );
+        CREATE TABLE playsets_mods (
+            playsetId TEXT, modId TEXT, position INTEGER, enabled INTEGER DEFAULT 1
+        );
+        """
+    )
+    db_connection.execute(
+        "INSERT INTO playsets VALUES ('benchmark', 'Benchmark', 1, 'custom', 0, '');"
+    )
+
+    # Log-normal sizes: mostly small text files, with a long tail of textures
+    sigma = 1.0
+    mu = math.log(args.mean_file_size) - sigma**2 / 2
+    for mod_index in range(args.mods):
+        files = {}
+        for file_index in range(args.files_per_mod):
+            if rng.random() < args.overlap:
+                # Paths shared by all mods, which later mods override
+                folder = f"common/shared_{rng.randrange(10)}"
+                rel_path = f"{folder}/{rng.randrange(args.files_per_mod)}.txt"
+            else:
+                folder = f"gfx/mod_{mod_index}/{file_index % 20}"
+                rel_path = f"{folder}/{file_index}.dds"
+            files[rel_path] = max(1, int(rng.lognormvariate(mu, sigma)))
+        files["descriptor.mod"] = 100
+        files["thumbnail.png"] = 10_000
+
+        mod_file = f'name="Mod {mod_index}"\n'
+        if mod_index and rng.random() < args.replace_paths:
+            mod_file += f'replace_path="common/shared_{rng.randrange(10)}"\n'
+        game_registry_id = f"mod/ugc_{mod_index}.mod"
+        (ck3_directory / game_registry_id).write_text(mod_file, encoding="utf-8")
+
+        dir_path = archive_path = None
+        if rng.random() < args.archives:
+            # Paradox Mods
+            archive_path = str(workshop / f"{mod_index}.zip")
+            with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_DEFLATED) as archive:
+                for rel_path, size in files.items():
+                    archive.writestr(rel_path, os.urandom(size))
+        else:
+            # Steam Workshop
+            dir_path = str(workshop / str(mod_index))
+            for rel_path, size in files.items():
+                dst = Path(dir_path, rel_path)
+                dst.parent.mkdir(parents=True, exist_ok=True)
+                dst.write_bytes(os.urandom(size))
+
+        mod_id = f"mod_{mod_index}"
+        db_connection.execute(
+            "INSERT INTO mods VALUES (?, ?, ?, '1.0', '[\"Gameplay\"]', '1.12.*', ?, ?,"
+            " 'ready_to_play', 'steam', 0);",
+            (mod_id, game_registry_id, f"Mod {mod_index}", dir_path, archive_path),
+        )
+        db_connection.execute(
+            "INSERT INTO playsets_mods VALUES ('benchmark', ?, ?, 1);",
+            (mod_id, mod_index),
+        )
+    db_connection.commit()
+    db_connection.close()
+    return ck3_directory
+
+
+@contextlib.contextmanager
+def quiet():
+    # Keep the program's own output out of the results
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(
+        io.StringIO()
+    ):
+        yield
+
+
+def run_preserve(ck3_directory, workers):
+    # Time each phase of preserving the playset once.
+    # Returns the seconds per phase and the merge plan.
+    timings = {}
+    new_mod_folder = ck3_directory / "mod" / "Benchmark"
+    shutil.rmtree(new_mod_folder, ignore_errors=True)
+    cache_path = ck3_directory / CK3_PP.SCAN_CACHE_FILE
+    for path in (cache_path, Path(f"{cache_path}-wal"), Path(f"{cache_path}-shm")):
+        path.unlink(missing_ok=True)
+
+    start = time.perf_counter()
+    db_path = ck3_directory / "launcher-v2.sqlite"
+    mods = CK3_PP.get_playset_mods(db_path, "benchmark")
+    timings["db_read"] = time.perf_counter() - start
+
+    with quiet():
+        scan_cache = CK3_PP.open_scan_cache(ck3_directory)
+        start = time.perf_counter()
+        merge_plan = CK3_PP.plan_playset(mods, ck3_directory, scan_cache)
+        timings["scan"] = time.perf_counter() - start
+        start = time.perf_counter()
+        CK3_PP.plan_playset(mods, ck3_directory, scan_cache)
+        timings["scan_cached"] = time.perf_counter() - start
+        scan_cache.close()
+
+        start = time.perf_counter()
+        provenance = CK3_PP.copy_mod_folders(
+            mods, new_mod_folder, merge_plan, workers=workers
+        )
+        timings["copy"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        CK3_PP.clean_combined_folder(new_mod_folder)
+        CK3_PP.create_dotmod_files(new_mod_folder, "Benchmark", "1.12.*", mods)
+        timings["descriptors"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        CK3_PP.create_mod_version_files(
+            new_mod_folder, {"name": "Benchmark"}, mods, provenance
+        )
+        timings["manifest"] = time.perf_counter() - start
+    return timings, merge_plan
+
+
+def time_copy(mods, new_mod_folder, workers):
+    start = time.perf_counter()
+    with quiet():
+        CK3_PP.copy_mod_folders(mods, new_mod_folder, workers=workers)
+    return time.perf_counter() - start
+
+
+def print_scaling(ck3_directory, total_bytes, max_workers):
+    # How copy throughput scales with the worker count
+    mods = CK3_PP.get_playset_mods(ck3_directory / "launcher-v2.sqlite", "benchmark")
+    print()
+    print(f"{'workers':>8} {'seconds':>8} {'MB/s':>8} {'speedup':>8}")
+    workers = 1
+    baseline = None
+    while workers <= max_workers:
+        new_mod_folder = ck3_directory / "mod" / f"bench_{workers}"
+        seconds = time_copy(mods, new_mod_folder, workers)
+        shutil.rmtree(new_mod_folder)
+        baseline = baseline or seconds
+        print(
+            f"{workers:>8} {seconds:>8.2f} {total_bytes / seconds / 1e6:>8.1f}"
+            f" {baseline / seconds:>7.2f}x"
+        )
+        workers *= 2
+
+
+def traced_bytes(build):
+    # Memory still allocated by build() once it returns what it built,
+    # and the most allocated at any point while it ran
+    gc.collect()
+    tracemalloc.start()
+    try:
+        kept = build()
+        size, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del kept
+    return {"held": size, "peak": peak}
+
+
+def measure_memory(ck3_directory, mods, merge_plan):
+    # Bytes per planned file taken by planning the playset from scratch,
+    # and held by the merge plan, compared with a list of PlannedFile tuples
+    # and with the {Path: display name} map that older versions kept
+    # of every file
+    files = merge_plan.files
+    with quiet():
+        planning = traced_bytes(lambda: CK3_PP.plan_playset(mods, ck3_directory))
+    return {
+        "planning": planning,
+        "PlannedFiles": traced_bytes(lambda: CK3_PP.PlannedFiles(files)),
+        "PlannedFile list": traced_bytes(lambda: list(files)),
+        "Path map": traced_bytes(
+            lambda: {
+                Path(planned.rel_path): mods[planned.mod_index]["displayName"]
+                for planned in files
+            }
+        ),
+    }
+
+
+def print_memory(memory, num_files):
+    print()
+    print(f"{'memory':<18} {'held':>10} {'peak':>10} {'peak/file':>9}")
+    for name, sizes in memory.items():
+        held = CK3_PP.format_size(sizes["held"])
+        peak = CK3_PP.format_size(sizes["peak"])
+        print(f"{name:<18} {held:>10} {peak:>10} {sizes['peak'] / num_files:>9.0f}")
+
+
+def print_comparison(results, baseline):
+    if baseline.get("format") != RESULTS_FORMAT:
+        print("The baseline was written by another version of the benchmark.")
+        return
+    if baseline["parameters"] != results["parameters"]:
+        print("WARNING: The baseline was measured with different parameters.")
+    print()
+    print(f"{'phase':<12} {'baseline':>9} {'now':>9} {'change':>8}")
+    for phase, seconds in results["seconds"].items():
+        if (old := baseline["seconds"].get(phase)) is None:
+            continue
+        change = (seconds - old) / old if old else 0.0
+        print(f"{phase:<12} {old:>9.3f} {seconds:>9.3f} {change:>+8.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure preserving a synthetic playset, phase by phase."
+    )
+    parser.add_argument("--mods", type=int, default=20)
+    parser.add_argument("--files-per-mod", type=int, default=300)
+    parser.add_argument(
+        "--mean-file-size", type=int, default=64 * 1024, help="in bytes"
+    )
+    parser.add_argument(
+        "--overlap",
+        type=float,
+        default=0.2,
+        help="fraction of each mod's files at paths other mods also provide",
+    )
+    parser.add_argument(
+        "--archives",
+        type=float,
+        default=0.2,
+        help="fraction of mods that are Paradox Mods archives",
+    )
+    parser.add_argument(
+        "--replace-paths",
+        type=float,
+        default=0.1,
+        help="fraction of mods declaring a replace_path",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=CK3_PP.DEFAULT_COPY_WORKERS)
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="runs to take the fastest of"
+    )
+    parser.add_argument("--output", type=Path, help="write the results to this file")
+    parser.add_argument(
+        "--baseline", type=Path, help="results file of an earlier run to compare with"
+    )
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        help="also measure copy throughput with 1, 2, 4... up to this many workers",
+    )
+    parser.add_argument(
+        "--memory",
+        action="store_true",
+        help="also measure the memory taken by planning and by the merge plan",
+    )
+    parser.add_argument(
+        "--dir", type=Path, help="directory to run in (default: system temp)"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as td:
+        ck3_directory = create_launcher(Path(td), args)
+        best = {}
+        for _ in range(args.repeat):
+            timings, merge_plan = run_preserve(ck3_directory, args.workers)
+            for phase, seconds in timings.items():
+                best[phase] = min(seconds, best.get(phase, seconds))
+
+        total_bytes = sum(planned.size for planned in merge_plan.files)
+        print(
+            f"{len(merge_plan.files)} files ({CK3_PP.format_size(total_bytes)}) copied,"
+            f" {CK3_PP.format_size(merge_plan.scanned_bytes)} scanned,"
+            f" fastest of {args.repeat} runs:"
+        )
+        for phase, seconds in best.items():
+            print(f"{phase:<12} {seconds:>9.3f} s")
+        copy_rate = CK3_PP.format_rate(total_bytes, best["copy"])
+        print(f"Copy throughput: {copy_rate}")
+
+        parameters = {
+            name: getattr(args, name)
+            for name in (
+                "mods",
+                "files_per_mod",
+                "mean_file_size",
+                "overlap",
+                "archives",
+                "replace_paths",
+                "seed",
+                "workers",
+            )
+        }
+        results = {
+            "format": RESULTS_FORMAT,
+            "parameters": parameters,
+            "environment": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            },
+            "files": len(merge_plan.files),
+            "bytes": total_bytes,
+            "scanned_bytes": merge_plan.scanned_bytes,
+            "seconds": {phase: round(seconds, 6) for phase, seconds in best.items()},
+        }
+        if args.memory:
+            mods = CK3_PP.get_playset_mods(
+                ck3_directory / "launcher-v2.sqlite", "benchmark"
+            )
+            results["memory"] = measure_memory(ck3_directory, mods, merge_plan)
+            print_memory(results["memory"], len(merge_plan.files))
+        if args.output:
+            args.output.write_text(json.dumps(results, indent=2) + "\n", encoding="utf-8")
+        if args.baseline:
+            print_comparison(
+                results, json.loads(args.baseline.read_text(encoding="utf-8"))
+            )
+        if args.max_workers:
+            print_scaling(ck3_directory, total_bytes, args.max_workers)
+
+
+if __name__ == "__main__":
+    sys.exit(main())